@@ -1,6 +1,9 @@
 # -*- coding: utf-8 -*-
 import os
+import re
 import sys
+import time
+import datetime
 import threading
 import queue
 import csv
@@ -13,6 +16,15 @@ if SCRIPT_DIR not in sys.path:
     sys.path.insert(0, SCRIPT_DIR)
 
 import file_text_searcher as core
+import result_store
+
+# search-as-you-type: wait this long after the last keystroke, and for at least this many characters
+LIVE_DELAY_MS = 300
+LIVE_MIN_CHARS = 2
+# results are read from the result store one page at a time
+PAGE_SIZE = 500
+# seconds between progress updates of a running search (pending matches are stored first)
+PROGRESS_INTERVAL = 0.5
 
 def _open_in_os(path: str):
     try:
@@ -36,16 +48,34 @@ class SearchApp(tk.Tk):
 
         self._build_vars()
         self._build_ui()
+        self.store = self._open_store()
 
         self.worker = None
         self.q = queue.Queue()
+        # queue messages carry the generation of the search that sent them; stale ones are dropped
+        self.generation = 0
+        self.cancel = None
+        self._live_job = None
+        # last completed search: candidate files and stored search id, reused while typing
+        self._cache = None
+        # search shown in the results table: search_id, term, case, structured, done
+        self.view = None
+        self.page_start = 0
+        self._encodings = {}
+        self.var_search.trace_add("write", self._on_term_changed)
         self.after(100, self._drain_queue)
 
     def _build_vars(self):
         self.var_dir = tk.StringVar(value=os.getcwd())
         self.var_search = tk.StringVar()
+        self.var_replace = tk.StringVar()
         self.var_case = tk.BooleanVar(value=False)
         self.var_recursive = tk.BooleanVar(value=False)
+        self.var_live = tk.BooleanVar(value=True)
+        self.var_follow_links = tk.BooleanVar(value=False)
+        self.var_dedupe = tk.BooleanVar(value=False)
+        self.var_multiline = tk.BooleanVar(value=False)
+        self.var_regex = tk.BooleanVar(value=False)
 
         # file type checkboxes
         self.var_txt = tk.BooleanVar(value=True)
@@ -55,6 +85,16 @@ class SearchApp(tk.Tk):
         self.var_json = tk.BooleanVar(value=False)
         self.var_custom = tk.StringVar(value="")
 
+        # metadata filters (blank = no limit)
+        self.var_newer = tk.StringVar(value="")
+        self.var_older = tk.StringVar(value="")
+        self.var_min_size = tk.StringVar(value="")
+        self.var_max_size = tk.StringVar(value="")
+
+        # structured search (comma separated, blank = search the whole text)
+        self.var_csv_columns = tk.StringVar(value="")
+        self.var_json_paths = tk.StringVar(value="")
+
         self.total_files = 0
         self.matched_files = 0
         self.total_hits = 0
@@ -73,6 +113,10 @@ class SearchApp(tk.Tk):
         e_dir.grid(row=0, column=3, sticky="we", **pad)
         ttk.Button(frm_top, text="Browse...", command=self._choose_dir).grid(row=0, column=4, sticky="we", **pad)
 
+        ttk.Label(frm_top, text="Replace with:").grid(row=1, column=0, sticky="w", **pad)
+        ttk.Entry(frm_top, textvariable=self.var_replace, width=42).grid(row=1, column=1, sticky="we", **pad)
+        ttk.Button(frm_top, text="Preview Replace...", command=self._preview_replace).grid(row=1, column=2, sticky="w", **pad)
+
         frm_top.columnconfigure(1, weight=1)
         frm_top.columnconfigure(3, weight=1)
 
@@ -90,27 +134,53 @@ class SearchApp(tk.Tk):
 
         ttk.Checkbutton(frm_opts, text="Case sensitive", variable=self.var_case).grid(row=1, column=0, sticky="w", padx=10, pady=4)
         ttk.Checkbutton(frm_opts, text="Include subdirectories", variable=self.var_recursive).grid(row=1, column=1, sticky="w", padx=10, pady=4)
+        ttk.Checkbutton(frm_opts, text="Search as you type", variable=self.var_live).grid(row=1, column=2, columnspan=2, sticky="w", padx=10, pady=4)
+        ttk.Checkbutton(frm_opts, text="Follow symlinks", variable=self.var_follow_links).grid(row=1, column=4, columnspan=2, sticky="w", padx=10, pady=4)
+        ttk.Checkbutton(frm_opts, text="Skip duplicate content", variable=self.var_dedupe).grid(row=1, column=6, columnspan=2, sticky="w", padx=10, pady=4)
+
+        ttk.Label(frm_opts, text="Newer than:").grid(row=2, column=0, sticky="e")
+        ttk.Entry(frm_opts, textvariable=self.var_newer, width=12).grid(row=2, column=1, sticky="w", padx=6, pady=4)
+        ttk.Label(frm_opts, text="Older than:").grid(row=2, column=2, sticky="e")
+        ttk.Entry(frm_opts, textvariable=self.var_older, width=12).grid(row=2, column=3, sticky="w", padx=6, pady=4)
+        ttk.Label(frm_opts, text="Min size:").grid(row=2, column=4, sticky="e")
+        ttk.Entry(frm_opts, textvariable=self.var_min_size, width=10).grid(row=2, column=5, sticky="w", padx=6, pady=4)
+        ttk.Label(frm_opts, text="Max size:").grid(row=2, column=6, sticky="e")
+        ttk.Entry(frm_opts, textvariable=self.var_max_size, width=10).grid(row=2, column=7, sticky="w", padx=6, pady=4)
+
+        ttk.Label(frm_opts, text="CSV columns:").grid(row=3, column=0, sticky="e")
+        ttk.Entry(frm_opts, textvariable=self.var_csv_columns, width=24).grid(row=3, column=1, columnspan=2, sticky="w", padx=6, pady=4)
+        ttk.Label(frm_opts, text="JSON paths:").grid(row=3, column=3, sticky="e")
+        ttk.Entry(frm_opts, textvariable=self.var_json_paths, width=24).grid(row=3, column=4, columnspan=3, sticky="w", padx=6, pady=4)
+
+        ttk.Checkbutton(frm_opts, text="Multi-line (\\n = line break)", variable=self.var_multiline).grid(row=4, column=0, columnspan=2, sticky="w", padx=10, pady=4)
+        ttk.Checkbutton(frm_opts, text="Regular expression", variable=self.var_regex).grid(row=4, column=2, columnspan=2, sticky="w", padx=10, pady=4)
 
         frm_btns = ttk.Frame(self)
         frm_btns.pack(fill="x", padx=8, pady=4)
         ttk.Button(frm_btns, text="Start Search", command=self._start_search).pack(side="left")
         ttk.Button(frm_btns, text="Export Results", command=self._export).pack(side="left", padx=6)
         ttk.Button(frm_btns, text="Clear", command=self._clear).pack(side="left", padx=6)
+        ttk.Button(frm_btns, text="History...", command=self._show_history).pack(side="left", padx=6)
+        ttk.Button(frm_btns, text="Top Patterns...", command=self._start_aggregate).pack(side="left", padx=6)
         ttk.Button(frm_btns, text="Exit", command=self.destroy).pack(side="right")
 
         # results tree
         frm_tree = ttk.Frame(self)
         frm_tree.pack(fill="both", expand=True, padx=8, pady=4)
 
-        columns = ("file", "line", "text")
+        columns = ("file", "line", "col", "field", "text")
         self.tree = ttk.Treeview(frm_tree, columns=columns, show="headings")
         self.tree.heading("file", text="File")
         self.tree.heading("line", text="Line")
+        self.tree.heading("col", text="Col")
+        self.tree.heading("field", text="Field")
         self.tree.heading("text", text="Content")
 
         self.tree.column("file", width=480, anchor="w")
         self.tree.column("line", width=60, anchor="center")
-        self.tree.column("text", width=400, anchor="w")
+        self.tree.column("col", width=60, anchor="center")
+        self.tree.column("field", width=120, anchor="w")
+        self.tree.column("text", width=280, anchor="w")
 
         vsb = ttk.Scrollbar(frm_tree, orient="vertical", command=self.tree.yview)
         hsb = ttk.Scrollbar(frm_tree, orient="horizontal", command=self.tree.xview)
@@ -125,9 +195,26 @@ class SearchApp(tk.Tk):
 
         self.tree.bind("<Double-1>", self._on_open_file)
 
+        frm_page = ttk.Frame(self)
+        frm_page.pack(fill="x", padx=8)
+        self.btn_prev = ttk.Button(frm_page, text="< Prev", command=lambda: self._turn_page(-1), state="disabled")
+        self.btn_prev.pack(side="left")
+        self.btn_next = ttk.Button(frm_page, text="Next >", command=lambda: self._turn_page(1), state="disabled")
+        self.btn_next.pack(side="left", padx=6)
+        self.lbl_page = ttk.Label(frm_page, text="")
+        self.lbl_page.pack(side="left", padx=6)
+
         self.status = ttk.Label(self, text="Ready")
         self.status.pack(fill="x", padx=8, pady=6)
 
+    def _open_store(self):
+        try:
+            return result_store.ResultStore()
+        except Exception as e:
+            # keep working without history rather than refusing to search
+            print("[ERROR]", f"result store unavailable, keeping results in memory: {e}")
+            return result_store.ResultStore(":memory:")
+
     def _choose_dir(self):
         d = filedialog.askdirectory(initialdir=self.var_dir.get() or os.getcwd())
         if d:
@@ -147,19 +234,105 @@ class SearchApp(tk.Tk):
             pats = ["*.txt"]
         return pats
 
-    def _start_search(self):
-        if self.worker and self.worker.is_alive():
-            messagebox.showinfo("Please Wait", "Search in progress, please stop or wait for completion.")
+    def _gather_filter(self):
+        """
+        Build a core.FileFilter from the filter fields; raises ValueError on bad input.
+        """
+        def _opt(var, parse):
+            text = var.get().strip()
+            return parse(text) if text else None
+        return core.FileFilter(
+            newer_than=_opt(self.var_newer, core.parse_time),
+            older_than=_opt(self.var_older, core.parse_time),
+            min_size=_opt(self.var_min_size, core.parse_size),
+            max_size=_opt(self.var_max_size, core.parse_size),
+        )
+
+    def _gather_options(self):
+        def _split(var):
+            return [x.strip() for x in var.get().split(",") if x.strip()]
+        return core.ScanOptions(csv_columns=_split(self.var_csv_columns), json_paths=_split(self.var_json_paths),
+                                multiline=self.var_multiline.get(), regex=self.var_regex.get())
+
+    def _search_key(self, directory, recursive, patterns):
+        """
+        Everything besides the term that decides the candidate files and how they are read.
+        """
+        fields = (self.var_newer, self.var_older, self.var_min_size, self.var_max_size,
+                  self.var_csv_columns, self.var_json_paths)
+        return ((tuple(directory), tuple(patterns), recursive, self.var_follow_links.get(), self.var_dedupe.get(),
+                 self.var_multiline.get(), self.var_regex.get())
+                + tuple(v.get().strip() for v in fields))
+
+    def _on_term_changed(self, *_):
+        if not self.var_live.get():
+            return
+        if self._live_job is not None:
+            self.after_cancel(self._live_job)
+        self._live_job = self.after(LIVE_DELAY_MS, self._live_search)
+
+    def _live_search(self):
+        self._live_job = None
+        if len(self.var_search.get().strip()) < LIVE_MIN_CHARS:
+            self._cancel_search()
+            self._clear()
             return
+        self._start_search(live=True)
+
+    def _cancel_search(self):
+        """
+        Abandon the running search: its readers stop at the next block and its queued results are ignored.
+        """
+        if self.cancel is not None:
+            self.cancel.set()
+        self.generation += 1
+
+    def _gather_search(self, live=False):
+        """
+        Read the search form: (term, directories, recursive, case, patterns, file_filter, options),
+        or None after telling the user what is missing.
+        """
         term = self.var_search.get().strip()
         if not term:
             messagebox.showwarning("Missing Search Term", "Please enter a string to search.")
+            return None
+        try:
+            file_filter = self._gather_filter()
+        except ValueError as e:
+            if live:
+                self.status.config(text=f"Invalid filter: {e}")
+            else:
+                messagebox.showwarning("Invalid Filter", str(e))
+            return None
+        if self.var_regex.get():
+            try:
+                core.compile_pattern(term, regex=True)
+            except re.error as e:
+                if live:
+                    self.status.config(text=f"Invalid regular expression: {e}")
+                else:
+                    messagebox.showwarning("Invalid Regular Expression", str(e))
+                return None
+        return (term, core.split_dirs(self.var_dir.get()), self.var_recursive.get(), self.var_case.get(),
+                self._gather_patterns(), file_filter, self._gather_options())
+
+    def _start_search(self, live=False):
+        form = self._gather_search(live)
+        if form is None:
             return
-
-        directory = self.var_dir.get().strip()
-        recursive = self.var_recursive.get()
-        case = self.var_case.get()
-        patterns = self._gather_patterns()
+        term, directory, recursive, case, patterns, file_filter, options = form
+
+        # While typing, keep the discovered files and encodings of the previous search;
+        # an explicit search starts from scratch.
+        key = self._search_key(directory, recursive, patterns)
+        cache = self._cache if live and self._cache is not None and self._cache["key"] == key else None
+        if cache is None:
+            self._cache = None
+            self._encodings = {}
+        self._cancel_search()
+        self.cancel = threading.Event()
+        options.encoding_cache = self._encodings
+        options.cancel = self.cancel
 
         # reset counters & UI
         self._clear()
@@ -168,49 +341,192 @@ class SearchApp(tk.Tk):
         # spawn worker
         self.worker = threading.Thread(
             target=self._worker_search,
-            args=(term, directory, recursive, case, patterns),
+            args=(self.generation, self.cancel, term, directory, recursive, case, patterns, file_filter, options, key, cache,
+                  self.var_follow_links.get(), self.var_dedupe.get(), live),
+            daemon=True
+        )
+        self.worker.start()
+
+    def _worker_search(self, gen, cancel, term, directory, recursive, case, patterns, file_filter, options, key, cache,
+                       follow_links, dedupe, live):
+        recorder = None
+        try:
+            # a regex or multi-line term that contains the previous one does not necessarily narrow its matches
+            pattern = options.multiline or options.regex
+            if (cache is not None and not pattern and cache["case"] == case
+                    and core.is_refinement(cache["term"], term, case)):
+                # the new term narrows the cached one: only its matching files/lines can still match
+                files, duplicates = cache["files"], cache["duplicates"]
+                results = core.refine_scan(self.store.iter_file_hits(cache["search_id"]), term, case, options=options)
+            else:
+                if cache is not None:
+                    files, duplicates = cache["files"], cache["duplicates"]
+                else:
+                    files = core.iter_files(directory, patterns, recursive=recursive, file_filter=file_filter,
+                                            follow_links=follow_links)
+                    duplicates = core.find_duplicates(files) if dedupe else None
+                results = core.scan_files(files, term, case, options=options, duplicates=duplicates)
+            structured = bool(options.csv_columns or options.json_paths)
+            recorder = self.store.begin_search(term, {
+                "dirs": [os.path.abspath(d) for d in directory or [os.getcwd()]], "patterns": ", ".join(patterns),
+                "recursive": recursive, "case_sensitive": case, "structured": structured, "pattern": pattern,
+                "live": live})
+            view = {"search_id": recorder.search_id, "term": term, "case": case, "structured": structured,
+                    "pattern": pattern, "done": False}
+            self.q.put((gen, "meta", {"total_files": len(files), "view": view}))
+            last_progress = time.monotonic()
+            for fp, matches, last, error in results:
+                if cancel.is_set():
+                    results.close()
+                    break
+                if matches:
+                    recorder.add(fp, matches)
+                if last and error is not None:
+                    self.q.put((gen, "error", f"{fp}: {error}"))
+                if time.monotonic() - last_progress >= PROGRESS_INTERVAL:
+                    recorder.flush()
+                    self.q.put((gen, "progress", {"matched_files": recorder.files, "total_hits": recorder.stored}))
+                    last_progress = time.monotonic()
+            if cancel.is_set():
+                # superseded by a newer search: do not keep a partial record
+                self.store.delete_search(recorder.search_id)
+                return
+            recorder.finish()
+            self.q.put((gen, "done", {
+                "matched_files": recorder.files, "total_hits": recorder.stored,
+                "cache": {"key": key, "files": files, "duplicates": duplicates, "term": term, "case": case,
+                          "search_id": recorder.search_id, "live": live},
+            }))
+        except Exception as e:
+            if recorder is not None:
+                recorder.finish()
+            self.q.put((gen, "fatal", str(e)))
+
+    def _start_aggregate(self):
+        """
+        Count the matching lines by pattern (numbers, UUIDs, timestamps masked) and show the most frequent ones.
+        """
+        form = self._gather_search()
+        if form is None:
+            return
+        self._cancel_search()
+        self.cancel = threading.Event()
+        form[-1].cancel = self.cancel
+        self.status.config(text="Counting line patterns...")
+        self.worker = threading.Thread(
+            target=self._worker_aggregate,
+            args=(self.generation, self.cancel) + form + (self.var_follow_links.get(), self.var_dedupe.get()),
             daemon=True
         )
         self.worker.start()
 
-    def _worker_search(self, term, directory, recursive, case, patterns):
+    def _worker_aggregate(self, gen, cancel, term, directory, recursive, case, patterns, file_filter, options,
+                          follow_links, dedupe):
         try:
-            files = core.iter_files(directory, patterns, recursive=recursive)
-            self.q.put(("meta", {"total_files": len(files)}))
+            files = core.iter_files(directory, patterns, recursive=recursive, file_filter=file_filter,
+                                    follow_links=follow_links)
+            duplicates = core.find_duplicates(files) if dedupe else None
+            summary = core.HeavyHitters()
             matched_files = 0
-            total_hits = 0
-            for fp in files:
-                had = False
-                try:
-                    for line_no, line in core.iter_matches(fp, term, case):
-                        self.q.put(("row", (fp, line_no, line)))
-                        total_hits += 1
-                        had = True
-                except Exception as e:
-                    self.q.put(("error", f"{fp}: {e}"))
-                if had:
+            last_progress = time.monotonic()
+            results = core.aggregate_files(files, term, summary, case, options=options, duplicates=duplicates)
+            for fp, lines, error in results:
+                if cancel.is_set():
+                    results.close()
+                    return
+                if lines:
                     matched_files += 1
-            self.q.put(("done", {"matched_files": matched_files, "total_hits": total_hits}))
+                if error is not None:
+                    self.q.put((gen, "error", f"{fp}: {error}"))
+                if time.monotonic() - last_progress >= PROGRESS_INTERVAL:
+                    self.q.put((gen, "aggregating", {"lines": summary.total, "matched_files": matched_files}))
+                    last_progress = time.monotonic()
+            if cancel.is_set():
+                return
+            self.q.put((gen, "aggregated", {"term": term, "lines": summary.total, "matched_files": matched_files,
+                                            "top": summary.top(core.DEFAULT_AGGREGATE_TOP)}))
         except Exception as e:
-            self.q.put(("fatal", str(e)))
+            self.q.put((gen, "fatal", str(e)))
+
+    def _show_top(self, result):
+        win = tk.Toplevel(self)
+        win.title(f"Top Patterns: {result['term']}")
+        win.geometry("900x420")
+        frm = ttk.Frame(win)
+        frm.pack(fill="both", expand=True, padx=8, pady=4)
+        columns = ("count", "pattern", "example")
+        tree = ttk.Treeview(frm, columns=columns, show="headings", selectmode="browse")
+        tree.heading("count", text="Count")
+        tree.heading("pattern", text="Pattern")
+        tree.heading("example", text="Example")
+        tree.column("count", width=90, anchor="e")
+        tree.column("pattern", width=480, anchor="w")
+        tree.column("example", width=300, anchor="w")
+        vsb = ttk.Scrollbar(frm, orient="vertical", command=tree.yview)
+        hsb = ttk.Scrollbar(frm, orient="horizontal", command=tree.xview)
+        tree.configure(yscrollcommand=vsb.set, xscrollcommand=hsb.set)
+        tree.grid(row=0, column=0, sticky="nsew")
+        vsb.grid(row=0, column=1, sticky="ns")
+        hsb.grid(row=1, column=0, sticky="ew")
+        frm.rowconfigure(0, weight=1)
+        frm.columnconfigure(0, weight=1)
+
+        examples = {}
+        for template, count, error, locations in result["top"]:
+            # '~': the count may include up to 'error' lines of templates evicted earlier
+            shown = f"~{count}" if error else count
+            iid = tree.insert("", "end", values=(shown, template, core.format_location(locations[0])))
+            examples[iid] = locations[0][0]
+
+        def _open(event):
+            item = tree.identify_row(event.y)
+            if item and os.path.isfile(examples[item]):
+                _open_in_os(examples[item])
+
+        tree.bind("<Double-1>", _open)
+        frm_btns = ttk.Frame(win)
+        frm_btns.pack(fill="x", padx=8, pady=6)
+        ttk.Label(frm_btns, text=f"{result['lines']} matching lines in {result['matched_files']} files").pack(side="left")
+        ttk.Button(frm_btns, text="Close", command=win.destroy).pack(side="right")
 
     def _drain_queue(self):
         try:
             while True:
-                tag, payload = self.q.get_nowait()
+                gen, tag, payload = self.q.get_nowait()
+                # replace messages (gen None) are never stale
+                if gen is not None and gen != self.generation:
+                    continue
                 if tag == "meta":
                     self.total_files = payload["total_files"]
+                    self.view = payload["view"]
+                    self.page_start = 0
                     self.status.config(text=f"Found {self.total_files} candidate files, starting matching...")
-                elif tag == "row":
-                    fp, ln, text = payload
-                    self.tree.insert("", "end", values=(fp, ln, text))
+                elif tag == "progress":
+                    if self.view is not None:
+                        self._update_totals(payload)
+                    self.status.config(text=f"Searching: {self.total_hits} matches in {self.matched_files} files so far...")
+                elif tag == "aggregating":
+                    self.status.config(text=f"Counting line patterns: {payload['lines']} matching lines in {payload['matched_files']} files so far...")
+                elif tag == "aggregated":
+                    self.status.config(text=f"Complete: {payload['lines']} matching lines in {payload['matched_files']} files.")
+                    self._show_top(payload)
                 elif tag == "error":
                     # Show but don't interrupt
                     print("[ERROR]", payload)
                 elif tag == "done":
-                    self.matched_files = payload["matched_files"]
-                    self.total_hits = payload["total_hits"]
+                    if self.view is not None:
+                        self._update_totals(payload)
+                        self.view["done"] = True
+                    cache, previous = payload["cache"], self._cache
+                    if cache["live"] and previous is not None and previous["live"]:
+                        # intermediate keystrokes do not belong in the history
+                        self.store.delete_search(previous["search_id"])
+                    self._cache = cache
                     self.status.config(text=f"Complete: Found {self.total_hits} matches in {self.matched_files} files.")
+                elif tag == "replaced":
+                    text = f"Replaced {payload['total']} occurrences in {payload['changed_files']} files."
+                    self.status.config(text=text)
+                    messagebox.showinfo("Replace Complete", text)
                 elif tag == "fatal":
                     messagebox.showerror("Search Failed", payload)
                     self.status.config(text="Failed")
@@ -219,8 +535,204 @@ class SearchApp(tk.Tk):
         finally:
             self.after(120, self._drain_queue)
 
+    def _update_totals(self, payload):
+        self.matched_files = payload["matched_files"]
+        self.total_hits = payload["total_hits"]
+        # fill the current page while it is not full yet, otherwise only the page label changes
+        if len(self.tree.get_children()) < PAGE_SIZE:
+            self._show_page()
+        else:
+            self._update_page_label()
+
+    def _show_page(self):
+        """
+        Load the current page of the shown search from the result store into the table.
+        """
+        for iid in self.tree.get_children():
+            self.tree.delete(iid)
+        if self.view is not None:
+            for fp, line_no, column, _, snippet, _, field in self.store.page(self.view["search_id"], self.page_start, PAGE_SIZE):
+                # a table row shows one line; multi-line snippets are joined with a marker
+                self.tree.insert("", "end", values=(fp, line_no, column, field, snippet.replace("\n", " ⏎ ")))
+        self._update_page_label()
+
+    def _update_page_label(self):
+        shown = len(self.tree.get_children())
+        if shown:
+            self.lbl_page.config(text=f"Rows {self.page_start + 1}-{self.page_start + shown} of {self.total_hits}")
+        else:
+            self.lbl_page.config(text="")
+        self.btn_prev.config(state="normal" if self.page_start > 0 else "disabled")
+        self.btn_next.config(state="normal" if self.page_start + PAGE_SIZE < self.total_hits else "disabled")
+
+    def _turn_page(self, step):
+        start = self.page_start + step * PAGE_SIZE
+        if self.view is None or start < 0 or start >= self.total_hits:
+            return
+        self.page_start = start
+        self._show_page()
+
+    def _show_history(self):
+        """
+        List the stored searches; a selected one is shown again without rescanning.
+        """
+        win = tk.Toplevel(self)
+        win.title("Search History")
+        win.geometry("820x400")
+        frm = ttk.Frame(win)
+        frm.pack(fill="both", expand=True, padx=8, pady=4)
+        columns = ("started", "term", "dirs", "matches", "files")
+        tree = ttk.Treeview(frm, columns=columns, show="headings", selectmode="browse")
+        tree.heading("started", text="Started")
+        tree.heading("term", text="Search term")
+        tree.heading("dirs", text="Directory")
+        tree.heading("matches", text="Matches")
+        tree.heading("files", text="Files")
+        tree.column("started", width=140, anchor="w")
+        tree.column("term", width=160, anchor="w")
+        tree.column("dirs", width=320, anchor="w")
+        tree.column("matches", width=80, anchor="center")
+        tree.column("files", width=80, anchor="center")
+        vsb = ttk.Scrollbar(frm, orient="vertical", command=tree.yview)
+        tree.configure(yscrollcommand=vsb.set)
+        tree.grid(row=0, column=0, sticky="nsew")
+        vsb.grid(row=0, column=1, sticky="ns")
+        frm.rowconfigure(0, weight=1)
+        frm.columnconfigure(0, weight=1)
+
+        entries = {}
+        for entry in self.store.history():
+            started = datetime.datetime.fromtimestamp(entry["started"]).strftime("%Y-%m-%d %H:%M:%S")
+            matches = entry["matches"] if entry["finished"] is not None else "interrupted"
+            iid = tree.insert("", "end", values=(started, entry["term"], ", ".join(entry["params"].get("dirs", [])),
+                                                 matches, entry["files"]))
+            entries[iid] = entry
+
+        def _selected():
+            sel = tree.selection()
+            return entries.get(sel[0]) if sel else None
+
+        def _open(*_):
+            entry = _selected()
+            if entry is not None:
+                win.destroy()
+                self._open_search(entry)
+
+        def _delete():
+            entry = _selected()
+            if entry is None:
+                return
+            self.store.delete_search(entry["id"])
+            tree.delete(tree.selection()[0])
+            if self._cache is not None and self._cache["search_id"] == entry["id"]:
+                self._cache = None
+            if self.view is not None and self.view["search_id"] == entry["id"]:
+                self._clear()
+
+        tree.bind("<Double-1>", _open)
+        frm_btns = ttk.Frame(win)
+        frm_btns.pack(fill="x", padx=8, pady=6)
+        ttk.Button(frm_btns, text="Close", command=win.destroy).pack(side="right")
+        ttk.Button(frm_btns, text="Delete", command=_delete).pack(side="right", padx=6)
+        ttk.Button(frm_btns, text="Open", command=_open).pack(side="right")
+
+    def _open_search(self, entry):
+        """
+        Show a stored search in the results table (the running search, if any, is abandoned).
+        """
+        self._cancel_search()
+        self._clear()
+        params = entry["params"]
+        self.view = {"search_id": entry["id"], "term": entry["term"], "case": params.get("case_sensitive", False),
+                     "structured": params.get("structured", False), "pattern": params.get("pattern", False), "done": True}
+        self.total_hits = self.store.count(entry["id"])
+        self.matched_files = entry["files"]
+        self._show_page()
+        self.status.config(text=f"Stored search '{entry['term']}': {self.total_hits} matches in {self.matched_files} files.")
+
+    def _preview_replace(self):
+        """
+        Show the changes a replace would make to the matches of the search shown in the table.
+        """
+        view = self.view
+        if view is None or not view["done"] or not self.total_hits:
+            messagebox.showinfo("No Data", "Run a search with matches first.")
+            return
+        if view["structured"]:
+            messagebox.showwarning("Plain Text Only", "Replace works on plain text; clear CSV columns and JSON paths and search again.")
+            return
+        if view["pattern"]:
+            messagebox.showwarning("Literal Text Only", "Replace works on single-line literal text; turn off Multi-line and Regular expression and search again.")
+            return
+        term, case, replacement = view["term"], view["case"], self.var_replace.get()
+        rx = re.compile(re.escape(term), 0 if case else re.IGNORECASE)
+        files = []
+
+        win = tk.Toplevel(self)
+        win.title("Replace Preview")
+        win.geometry("900x520")
+        frm = ttk.Frame(win)
+        frm.pack(fill="both", expand=True, padx=8, pady=4)
+        txt = tk.Text(frm, wrap="none", font="TkFixedFont")
+        vsb = ttk.Scrollbar(frm, orient="vertical", command=txt.yview)
+        hsb = ttk.Scrollbar(frm, orient="horizontal", command=txt.xview)
+        txt.configure(yscrollcommand=vsb.set, xscrollcommand=hsb.set)
+        txt.grid(row=0, column=0, sticky="nsew")
+        vsb.grid(row=0, column=1, sticky="ns")
+        hsb.grid(row=1, column=0, sticky="ew")
+        frm.rowconfigure(0, weight=1)
+        frm.columnconfigure(0, weight=1)
+
+        txt.tag_configure("file", foreground="#0040a0")
+        txt.tag_configure("old", foreground="#b00000")
+        txt.tag_configure("new", foreground="#007000")
+        for fp, hits in self.store.iter_file_hits(view["search_id"]):
+            files.append(fp)
+            txt.insert("end", f"{fp}\n", "file")
+            for line_no, _, _, snippet, _, _ in hits:
+                txt.insert("end", f"- {line_no}: {snippet}\n", "old")
+                txt.insert("end", f"+ {line_no}: {rx.sub(lambda m: replacement, snippet)}\n", "new")
+        txt.config(state="disabled")
+
+        frm_btns = ttk.Frame(win)
+        frm_btns.pack(fill="x", padx=8, pady=6)
+        ttk.Label(frm_btns, text=f"{len(files)} files will be rewritten").pack(side="left")
+        ttk.Button(frm_btns, text="Cancel", command=win.destroy).pack(side="right")
+        ttk.Button(frm_btns, text="Apply",
+                   command=lambda: self._apply_replace(win, files, term, replacement, case)).pack(side="right", padx=6)
+
+    def _apply_replace(self, win, files, term, replacement, case):
+        if not messagebox.askyesno("Confirm Replace", f"Replace '{term}' with '{replacement}' in {len(files)} files?", parent=win):
+            return
+        win.destroy()
+        self._cancel_search()
+        # the files change: cached matches and encodings no longer apply
+        self._cache = None
+        self._encodings = {}
+        self.status.config(text="Replacing...")
+        self.worker = threading.Thread(
+            target=self._worker_replace,
+            args=(files, term, replacement, case),
+            daemon=True
+        )
+        self.worker.start()
+
+    def _worker_replace(self, files, term, replacement, case):
+        try:
+            changed_files = 0
+            total = 0
+            for fp, count, error in core.replace_files(files, term, replacement, case):
+                if count:
+                    changed_files += 1
+                    total += count
+                if error is not None:
+                    self.q.put((None, "error", f"{fp}: {error}"))
+            self.q.put((None, "replaced", {"changed_files": changed_files, "total": total}))
+        except Exception as e:
+            self.q.put((None, "fatal", str(e)))
+
     def _export(self):
-        if not self.tree.get_children():
+        if self.view is None or not self.total_hits:
             messagebox.showinfo("No Data", "No results to export.")
             return
         path = filedialog.asksaveasfilename(
@@ -233,25 +745,25 @@ class SearchApp(tk.Tk):
         try:
             with open(path, "w", newline="", encoding="utf-8") as f:
                 w = csv.writer(f)
-                w.writerow(["file", "line", "text"])
-                for iid in self.tree.get_children():
-                    row = self.tree.item(iid, "values")
-                    w.writerow(row)
+                w.writerow(["file", "line", "col", "field", "text"])
+                for fp, line_no, column, _, snippet, _, field in self.store.iter_matches(self.view["search_id"]):
+                    w.writerow((fp, line_no, column, field, snippet))
             messagebox.showinfo("Export Successful", f"Exported to: {path}")
         except Exception as e:
             messagebox.showerror("Export Failed", str(e))
 
     def _clear(self):
-        for iid in self.tree.get_children():
-            self.tree.delete(iid)
+        self.view = None
+        self.page_start = 0
         self.total_files = self.matched_files = self.total_hits = 0
+        self._show_page()
         self.status.config(text="Ready")
 
     def _on_open_file(self, event):
         item = self.tree.identify_row(event.y)
         if not item:
             return
-        fp, ln, _ = self.tree.item(item, "values")
+        fp = self.tree.item(item, "values")[0]
         if not os.path.isfile(fp):
             messagebox.showwarning("File Does Not Exist", fp)
             return
@@ -1,5 +1,6 @@
 # -*- coding: utf-8 -*-
 import argparse
+import re
 import sys
 import os
 
@@ -9,6 +10,15 @@ if SCRIPT_DIR not in sys.path:
     sys.path.insert(0, SCRIPT_DIR)
 
 import file_text_searcher as core
+import result_store
+
+def _time_arg(text: str) -> str:
+    # checked here, resolved by TimeWindow, which keeps the text for --checkpoint
+    try:
+        core.parse_time(text)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e)) from None
+    return text
 
 def _parse_args():
     p = argparse.ArgumentParser(
@@ -20,22 +30,131 @@ def _parse_args():
 
     p.add_argument("-s", "--search", help="String to search (if not provided, enter interactive mode)")
     p.add_argument("-b", "--batch", nargs="+", help="Batch search multiple strings (space separated)")
-    p.add_argument("-d", "--dir", default="", help="Directory to search (blank=current directory)")
+    p.add_argument("--replace", metavar="TEXT", help="Replace the search string with TEXT in place (files without a match are not written)")
+    p.add_argument("-d", "--dir", nargs="+", action="extend", default=[], help="Directories to search (repeatable, blank=current directory)")
+    p.add_argument("--stdin", action="store_true", help="search standard input as it arrives instead of files (same as -d -)")
     p.add_argument("-e", "--ext", action="append", help="File wildcard (can be used multiple times, e.g. -e *.txt -e *.log)")
     p.add_argument("--all-types", action="store_true", help="Use common text types (*.txt, *.log, *.csv, *.xml, *.json)")
     p.add_argument("-R", "--recursive", action="store_true", help="Include subdirectories")
+    p.add_argument("-L", "--follow-links", action="store_true", help="Follow symlinked subdirectories (each directory is visited once)")
+    p.add_argument("--dedupe-content", action="store_true", help="Scan byte-identical files once and report the matches for every copy")
     p.add_argument("-i", "--case-sensitive", action="store_true", help="Case sensitive")
+    p.add_argument("-M", "--multiline", action="store_true", help="Let the search string span lines (write line breaks as \\n); matches report start and end line")
+    p.add_argument("-E", "--regex", action="store_true", help="Treat the search string as a regular expression that may span lines")
+    p.add_argument("--newer-than", type=core.parse_time, metavar="AGE|DATE", help="Only files modified after this age/date (e.g. 1d, 12h, 2024-05-01)")
+    p.add_argument("--older-than", type=core.parse_time, metavar="AGE|DATE", help="Only files modified before this age/date")
+    p.add_argument("--min-size", type=core.parse_size, metavar="SIZE", help="Only files of at least this size (e.g. 10k, 5M)")
+    p.add_argument("--max-size", type=core.parse_size, metavar="SIZE", help="Only files of at most this size (e.g. 1G)")
+    p.add_argument("--since", type=_time_arg, metavar="AGE|DATE", help="Only log lines timestamped at or after this age/date (files must be sorted by time)")
+    p.add_argument("--until", type=_time_arg, metavar="AGE|DATE", help="Only log lines timestamped at or before this age/date")
+    p.add_argument("--time-format", action="append", metavar="FORMAT", help="strptime format of the timestamp at the start of each line (repeatable, default: ISO-like formats)")
+    p.add_argument("--csv-column", action="append", metavar="NAME|N", help="Only match inside this CSV column (header name or 1-based number, repeatable)")
+    p.add_argument("--csv-no-header", action="store_true", help="CSV files have no header row: the first record is data and columns are selected by number")
+    p.add_argument("--json-path", action="append", metavar="PATH", help="Only match values under this JSON key path (e.g. items.*.name, /items/*/name, **.message; repeatable)")
+    p.add_argument("-j", "--jobs", type=int, default=core.DEFAULT_WORKERS, help="Parallel readers per SSD/remote device (spinning disks are always read sequentially)")
+    p.add_argument("--max-read-rate", type=core.parse_size, metavar="RATE", help="Limit the total read rate in bytes/s (e.g. 20M); paced with a token bucket")
+    p.add_argument("--max-open-files", type=int, metavar="N", help="Limit the number of files open at the same time")
+    p.add_argument("--read-buffer", type=core.parse_size, default=core.DEFAULT_READ_BUFFER, metavar="SIZE", help="bytes fetched from storage per read (e.g. 4M; default 1M)")
+    p.add_argument("--drop-cache", action="store_true", help="drop the pages of each scanned file from the OS cache afterwards")
+    p.add_argument("--nice", action="store_true", help="Lower the CPU and I/O priority of the search")
+    p.add_argument("--order", choices=sorted(core.FILE_ORDERS), help="Scan files in this order: newest first, smallest first or by path (default: discovery order)")
+    p.add_argument("--first", type=int, metavar="N", help="Stop after the first N matches")
+    p.add_argument("--unordered", action="store_true", help="Print files as soon as they finish instead of in discovery order")
+    p.add_argument("--aggregate", nargs="?", type=int, const=core.DEFAULT_AGGREGATE_TOP, metavar="K", help="Report the K most frequent matching line patterns (numbers, UUIDs, timestamps masked) instead of every line (default K: %(const)s)")
+    p.add_argument("--store", nargs="?", const=result_store.DEFAULT_STORE_PATH, metavar="DB", help="Also record the results in a SQLite result store (default: ~/.text_searcher/results.db)")
+    p.add_argument("--history", action="store_true", help="List the searches recorded in the result store")
+    p.add_argument("--checkpoint", metavar="FILE", help="save progress to FILE so an interrupted search can be resumed by running it again")
+    p.add_argument("--show", type=int, metavar="ID", help="Print a recorded search from the result store without rescanning")
+
+    args = p.parse_args()
+    if args.csv_no_header and any(not c.isdigit() for c in args.csv_column or []):
+        p.error("--csv-no-header selects columns by number only (e.g. --csv-column 2)")
+    if "-" in args.dir:
+        if len(args.dir) > 1:
+            p.error("-d - (standard input) cannot be combined with other directories")
+        args.stdin, args.dir = True, []
+    if args.stdin:
+        if not args.search:
+            p.error("--stdin needs a search term (-s)")
+        if args.dir or args.batch or args.replace is not None or args.aggregate is not None or args.checkpoint:
+            p.error("--stdin searches one term (-s) and cannot be combined with -d, -b/--batch, --replace, --aggregate or --checkpoint")
+        if args.since is not None or args.until is not None or args.csv_column or args.json_path:
+            p.error("--since/--until and --csv-column/--json-path need files, not --stdin")
+    if not 64 * 1024 <= args.read_buffer <= 256 * 1024 * 1024:
+        p.error("--read-buffer must be between 64k and 256M")
+    if args.first is not None and args.first < 1:
+        p.error("--first must be at least 1")
+    if args.aggregate is not None:
+        if args.aggregate < 1:
+            p.error("--aggregate must be at least 1")
+        if args.replace is not None or args.store or args.first is not None:
+            p.error("--aggregate cannot be combined with --replace, --store or --first")
+    if args.checkpoint and (args.batch or args.first is not None or args.aggregate is not None or args.replace is not None):
+        p.error("--checkpoint cannot be combined with -b/--batch, --first, --aggregate or --replace")
+    if args.regex:
+        for term in [args.search] + (args.batch or []):
+            try:
+                core.compile_pattern(term or "", regex=True)
+            except re.error as e:
+                p.error(f"invalid regular expression '{term}': {e}")
+    if args.replace is not None:
+        if args.multiline or args.regex:
+            p.error("--replace works on literal single-line text and cannot be combined with --multiline/--regex")
+        if not args.search or args.batch:
+            p.error("--replace needs -s/--search and cannot be combined with -b/--batch")
+        if args.csv_column or args.json_path:
+            p.error("--replace works on plain text and cannot be combined with --csv-column/--json-path")
+        if args.store:
+            p.error("--store records searches and cannot be combined with --replace")
+    return args
+
+def _broken_pipe():
+    # the reader went away (e.g. '| head'): stop quietly like other pipeline tools;
+    # stdout now points to devnull so the flush at interpreter exit cannot fail again
+    devnull = os.open(os.devnull, os.O_WRONLY)
+    os.dup2(devnull, sys.stdout.fileno())
+    sys.exit(1)
 
-    return p.parse_args()
+def _search_stdin(args):
+    options = core.ScanOptions(multiline=args.multiline, regex=args.regex)
+    store = result_store.ResultStore(args.store) if args.store else None
+    try:
+        core.search_stream(args.search, args.case_sensitive, options=options, max_hits=args.first, store=store)
+    except BrokenPipeError:
+        _broken_pipe()
+    except KeyboardInterrupt:
+        sys.exit(130)
+    finally:
+        if store is not None:
+            store.close()
 
 def main():
     args = _parse_args()
 
+    core.set_io_limits(args.max_read_rate, args.max_open_files, args.read_buffer, args.drop_cache)
+    if args.nice and not core.lower_priority():
+        print("⚠️ Could not lower the process priority")
+
     if args.gui:
         import gui_app
         gui_app.launch()
         return
 
+    if args.history or args.show is not None:
+        store = result_store.ResultStore(args.store or result_store.DEFAULT_STORE_PATH)
+        try:
+            if args.show is not None:
+                core.show_stored_search(store, args.show)
+            else:
+                core.print_history(store)
+        finally:
+            store.close()
+        return
+
+    if args.stdin:
+        _search_stdin(args)
+        return
+
     # If neither search nor batch provided, or --interactive forced -> menu
     if args.interactive or (not args.search and not args.batch):
         core.menu_loop()
@@ -49,14 +168,36 @@ def main():
     else:
         patterns = ["*.txt"]
 
-    if args.batch:
-        for term in args.batch:
-            print(f"\n>>> Searching: '{term}'")
-            for pat in patterns:
-                core.search_in_files(term, pat, args.case_sensitive, args.dir, args.recursive)
-    else:
-        for pat in patterns:
-            core.search_in_files(args.search, pat, args.case_sensitive, args.dir, args.recursive)
+    file_filter = core.FileFilter(args.newer_than, args.older_than, args.min_size, args.max_size)
+    time_window = None
+    if args.since is not None or args.until is not None:
+        time_window = core.TimeWindow(args.since, args.until, args.time_format)
+    options = core.ScanOptions(csv_columns=args.csv_column, json_paths=args.json_path, time_window=time_window,
+                               csv_header=not args.csv_no_header,
+                               multiline=args.multiline, regex=args.regex)
+
+    store = result_store.ResultStore(args.store) if args.store else None
+
+    # all patterns go into one search so --order and --first apply across them
+    try:
+        if args.replace is not None:
+            core.replace_in_files(args.search, args.replace, patterns, args.case_sensitive, args.dir, args.recursive, workers=args.jobs, file_filter=file_filter, follow_links=args.follow_links)
+        elif args.batch:
+            for term in args.batch:
+                print(f"\n>>> Searching: '{term}'")
+                core.search_in_files(term, patterns, args.case_sensitive, args.dir, args.recursive, workers=args.jobs, file_filter=file_filter, ordered=not args.unordered, options=options, follow_links=args.follow_links, dedupe_content=args.dedupe_content, order=args.order, max_hits=args.first, store=store, aggregate=args.aggregate)
+        else:
+            core.search_in_files(args.search, patterns, args.case_sensitive, args.dir, args.recursive, workers=args.jobs, file_filter=file_filter, ordered=not args.unordered, options=options, follow_links=args.follow_links, dedupe_content=args.dedupe_content, order=args.order, max_hits=args.first, store=store, aggregate=args.aggregate, checkpoint=args.checkpoint)
+    except BrokenPipeError:
+        _broken_pipe()
+    except KeyboardInterrupt:
+        if not args.checkpoint:
+            raise
+        # the checkpoint has been saved; run the same command again to resume
+        sys.exit(130)
+    finally:
+        if store is not None:
+            store.close()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
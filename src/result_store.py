@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+"""
+On-disk result store: every search and its matches are written incrementally to a
+local SQLite database, so large result sets do not have to live in memory and past
+searches can be reopened without rescanning.
+"""
+import os
+import json
+import time
+import sqlite3
+import threading
+from typing import Dict, Generator, Iterable, List, Optional, Tuple
+
+# Default database location (shared by the CLI and the GUI)
+DEFAULT_STORE_PATH = os.path.join(os.path.expanduser("~"), ".text_searcher", "results.db")
+# Match rows buffered before they are inserted in one transaction
+BATCH_ROWS = 1000
+# Searches kept in the history; older ones are deleted together with their matches
+MAX_HISTORY = 200
+
+# Row of a stored match: (path, line, column, byte_offset, snippet, clipped, field)
+StoredMatch = Tuple[str, int, int, int, str, bool, str]
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS searches (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    term TEXT NOT NULL,
+    params TEXT NOT NULL,
+    started REAL NOT NULL,
+    finished REAL,
+    files INTEGER NOT NULL DEFAULT 0,
+    matches INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS searches_term ON searches (term);
+CREATE TABLE IF NOT EXISTS matches (
+    search_id INTEGER NOT NULL REFERENCES searches (id) ON DELETE CASCADE,
+    seq INTEGER NOT NULL,
+    path TEXT NOT NULL,
+    line INTEGER NOT NULL,
+    col INTEGER NOT NULL,
+    offset INTEGER NOT NULL,
+    snippet TEXT NOT NULL,
+    clipped INTEGER NOT NULL,
+    field TEXT NOT NULL,
+    PRIMARY KEY (search_id, seq)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS matches_path ON matches (path, search_id);
+"""
+
+class ResultStore:
+    """
+    SQLite database of searches (term, parameters, times, counts) and their matches.
+    Matches are numbered per search in the order they were added, which is also
+    the order pages are read in. The connection is shared between threads.
+    """
+    def __init__(self, path: str=DEFAULT_STORE_PATH):
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        with self.lock:
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("PRAGMA synchronous=NORMAL")
+            self.conn.execute("PRAGMA foreign_keys=ON")
+            self.conn.executescript(_SCHEMA)
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+    def begin_search(self, term: str, params: Optional[Dict]=None) -> "SearchRecorder":
+        """
+        Register a new search and return a recorder that stores its matches.
+        """
+        with self.lock, self.conn:
+            cur = self.conn.execute(
+                "INSERT INTO searches (term, params, started) VALUES (?, ?, ?)",
+                (term, json.dumps(params or {}, ensure_ascii=False), time.time()))
+            search_id = cur.lastrowid
+            # keep the history bounded
+            self.conn.execute(
+                "DELETE FROM searches WHERE id <= ?", (search_id - MAX_HISTORY,))
+        return SearchRecorder(self, search_id)
+
+    def _insert(self, search_id: int, first_seq: int, rows: List[StoredMatch]):
+        with self.lock, self.conn:
+            self.conn.executemany(
+                "INSERT INTO matches (search_id, seq, path, line, col, offset, snippet, clipped, field) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [(search_id, first_seq + i) + tuple(row) for i, row in enumerate(rows)])
+
+    def _finish(self, search_id: int, files: int, matches: int):
+        with self.lock, self.conn:
+            self.conn.execute(
+                "UPDATE searches SET finished = ?, files = ?, matches = ? WHERE id = ?",
+                (time.time(), files, matches, search_id))
+
+    def delete_search(self, search_id: int):
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM searches WHERE id = ?", (search_id,))
+
+    def _searches(self, where: str, args: tuple) -> List[Dict]:
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT id, term, params, started, finished, files, matches FROM searches " + where, args).fetchall()
+        keys = ("id", "term", "params", "started", "finished", "files", "matches")
+        return [dict(zip(keys, r[:2] + (json.loads(r[2]),) + r[3:])) for r in rows]
+
+    def history(self, limit: int=MAX_HISTORY, term: Optional[str]=None) -> List[Dict]:
+        """
+        Past searches, newest first, optionally only those for 'term'.
+        Each entry has id, term, params, started, finished (None if interrupted), files, matches.
+        """
+        if term is None:
+            return self._searches("ORDER BY id DESC LIMIT ?", (limit,))
+        return self._searches("WHERE term = ? ORDER BY id DESC LIMIT ?", (term, limit))
+
+    def get_search(self, search_id: int) -> Optional[Dict]:
+        """
+        The history entry of one search, or None if it is not (or no longer) stored.
+        """
+        found = self._searches("WHERE id = ?", (search_id,))
+        return found[0] if found else None
+
+    def count(self, search_id: int) -> int:
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM matches WHERE search_id = ?", (search_id,)).fetchone()[0]
+
+    def page(self, search_id: int, start: int, size: int) -> List[StoredMatch]:
+        """
+        Matches number start .. start+size-1 of a search (0-based, in insertion order).
+        """
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT path, line, col, offset, snippet, clipped, field FROM matches "
+                "WHERE search_id = ? AND seq >= ? ORDER BY seq LIMIT ?",
+                (search_id, start, size)).fetchall()
+        return [r[:5] + (bool(r[5]), r[6]) for r in rows]
+
+    def iter_matches(self, search_id: int, size: int=BATCH_ROWS) -> Generator[StoredMatch, None, None]:
+        """
+        All matches of a search, read page by page.
+        """
+        start = 0
+        while True:
+            rows = self.page(search_id, start, size)
+            yield from rows
+            if len(rows) < size:
+                return
+            start += size
+
+    def iter_file_hits(self, search_id: int) -> Generator[Tuple[str, List[tuple]], None, None]:
+        """
+        (path, hits) per file of a search, hits in the scanner's
+        (line, column, byte_offset, snippet, clipped, field) form.
+        """
+        path, hits = None, []
+        for row in self.iter_matches(search_id):
+            if row[0] != path:
+                if hits:
+                    yield path, hits
+                path, hits = row[0], []
+            hits.append(row[1:])
+        if hits:
+            yield path, hits
+
+class SearchRecorder:
+    """
+    Buffers the matches of one search and inserts them in batches of BATCH_ROWS
+    rows per transaction.
+    """
+    def __init__(self, store: ResultStore, search_id: int):
+        self.store = store
+        self.search_id = search_id
+        self.pending: List[StoredMatch] = []
+        self.stored = 0
+        self.files = 0
+        self.last_path: Optional[str] = None
+
+    def add(self, file_path: str, hits: Iterable[tuple]):
+        """
+        Record the hits (scanner form) of one file. Consecutive calls for the same
+        file (e.g. a stream recorded hit by hit) count it once.
+        """
+        before = len(self.pending)
+        for line, column, offset, snippet, clipped, field in hits:
+            self.pending.append((file_path, line, column, offset, snippet, bool(clipped), field))
+        if len(self.pending) > before and file_path != self.last_path:
+            self.files += 1
+            self.last_path = file_path
+        if len(self.pending) >= BATCH_ROWS:
+            self.flush()
+
+    def flush(self):
+        if self.pending:
+            self.store._insert(self.search_id, self.stored, self.pending)
+            self.stored += len(self.pending)
+            self.pending = []
+
+    @property
+    def matches(self) -> int:
+        return self.stored + len(self.pending)
+
+    def finish(self):
+        """
+        Store the remaining matches and mark the search as complete.
+        """
+        self.flush()
+        self.store._finish(self.search_id, self.files, self.stored)
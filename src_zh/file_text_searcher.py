@@ -6,107 +6,2878 @@ optional recursive search, and preserves interactive CLI mode.
 This file is adapted from the user's original script.
 """
 import os
+import re
+import sys
+import copy
+import csv
 import glob
-from typing import Iterable, List, Tuple, Generator, Union
+import json
+import stat
+import codecs
+import io
+import gzip
+import contextlib
+import hashlib
+import shutil
+import fnmatch
+import itertools
+import collections
+import time
+import queue
+import pickle
+import datetime
+import tempfile
+import threading
+import subprocess
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple, Generator, Union
+
+# Default number of parallel readers per non-rotational device (SSD, NFS, ...)
+DEFAULT_WORKERS = 4
+# Match lines kept in memory while waiting for earlier files in ordered output
+DEFAULT_REORDER_LINES = 10000
+# Hits handed on together by a file scan, and seconds after which a smaller batch is handed on
+SCAN_BATCH_HITS = 1000
+SCAN_BATCH_SECONDS = 0.05
+# Batches waiting between the readers of scan_files and its caller
+_RESULT_QUEUE_BATCHES = 64
+# Bytes read per block by the scanner
+DEFAULT_BLOCK_SIZE = 256 * 1024
+# Buffer between the scanner and the file: each read from storage fetches this many bytes
+DEFAULT_READ_BUFFER = 1024 * 1024
+# Lines up to this many characters are reported whole, longer ones are clipped
+MAX_LINE_CHARS = 512
+# Characters kept on each side of a match in a clipped snippet
+SNIPPET_CONTEXT = 80
+
+# gbk with surrogateescape accepts any byte sequence and still round-trips to the original bytes
+_ENCODINGS = (("utf-8", "strict"), ("gbk", "surrogateescape"))
+_SURROGATES = re.compile("[\udc80-\udcff]")
 
 def _normalize_dir(directory: str) -> str:
     d = directory or os.getcwd()
     return os.path.abspath(d)
 
-def iter_files(directory: str, file_patterns: Union[str, List[str]], recursive: bool=False) -> List[str]:
+def _normalize_dirs(directory: Union[str, List[str]]) -> List[str]:
+    """
+    Accept a single directory or a list of directories; blank -> current dir.
+    Duplicates are dropped while keeping the given order.
+    """
+    dirs = [directory] if isinstance(directory, str) else list(directory)
+    if not dirs:
+        dirs = [""]
+    uniq = []
+    for d in dirs:
+        d = _normalize_dir(d)
+        if d not in uniq:
+            uniq.append(d)
+    return uniq
+
+def split_dirs(text: str) -> List[str]:
+    """
+    Split a user-entered directory string into several roots (os.pathsep separated).
+    """
+    return [d.strip() for d in text.split(os.pathsep) if d.strip()]
+
+def _describe_dirs(directory: Union[str, List[str]]) -> str:
+    return ", ".join(_normalize_dirs(directory))
+
+def _describe_patterns(file_patterns: Union[str, List[str]]) -> str:
+    return file_patterns if isinstance(file_patterns, str) else ", ".join(file_patterns)
+
+# ------------------ Metadata filters ------------------
+
+_SIZE_UNITS = {"": 1, "b": 1, "k": 1024, "m": 1024 ** 2, "g": 1024 ** 3, "t": 1024 ** 4}
+_AGE_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400, "w": 7 * 86400}
+
+def parse_size(text: str) -> int:
+    """
+    Parse a size such as '512', '10k', '5M' or '1.5G' (binary units) into bytes.
+    """
+    t = text.strip().lower()
+    if t.endswith("ib"):
+        t = t[:-2]
+    elif t.endswith("b") and len(t) > 1 and t[-2] in _SIZE_UNITS:
+        t = t[:-1]
+    unit = t[-1:] if t[-1:].isalpha() else ""
+    if unit not in _SIZE_UNITS:
+        raise ValueError(f"invalid size: {text!r}")
+    try:
+        return int(float(t[:len(t) - len(unit)]) * _SIZE_UNITS[unit])
+    except ValueError:
+        raise ValueError(f"invalid size: {text!r}") from None
+
+def parse_time(text: str, now: Optional[float]=None) -> float:
+    """
+    Parse an age ('90s', '30m', '12h', '1d', '2w') or an ISO date/datetime
+    ('2024-05-01', '2024-05-01T08:00') into a POSIX timestamp.
+    Ages are counted back from 'now' (default: current time).
+    """
+    t = text.strip()
+    unit = t[-1:].lower()
+    if unit in _AGE_UNITS:
+        try:
+            amount = float(t[:-1])
+        except ValueError:
+            amount = None
+        if amount is not None:
+            return (time.time() if now is None else now) - amount * _AGE_UNITS[unit]
+    try:
+        return datetime.datetime.fromisoformat(t).timestamp()
+    except ValueError:
+        raise ValueError(f"invalid time or age: {text!r}") from None
+
+class FileFilter:
+    """
+    Metadata predicates (mtime window, size range) evaluated against the stat
+    data fetched during traversal, so rejected files are never opened.
+    Time bounds are POSIX timestamps, size bounds are bytes; None disables a bound.
+    """
+    def __init__(self, newer_than: Optional[float]=None, older_than: Optional[float]=None,
+                 min_size: Optional[int]=None, max_size: Optional[int]=None):
+        self.newer_than = newer_than
+        self.older_than = older_than
+        self.min_size = min_size
+        self.max_size = max_size
+
+    def __bool__(self) -> bool:
+        return any(v is not None for v in (self.newer_than, self.older_than, self.min_size, self.max_size))
+
+    def __call__(self, st: os.stat_result) -> bool:
+        if self.newer_than is not None and st.st_mtime < self.newer_than:
+            return False
+        if self.older_than is not None and st.st_mtime > self.older_than:
+            return False
+        if self.min_size is not None and st.st_size < self.min_size:
+            return False
+        if self.max_size is not None and st.st_size > self.max_size:
+            return False
+        return True
+
+# Scan orders for iter_files: key on (path, stat_result)
+FILE_ORDERS = {
+    "mtime-desc": lambda item: -item[1].st_mtime,
+    "size-asc": lambda item: item[1].st_size,
+    "path": lambda item: item[0],
+}
+
+def iter_files(directory: Union[str, List[str]], file_patterns: Union[str, List[str]], recursive: bool=False,
+               file_filter: Optional[FileFilter]=None, follow_links: bool=False,
+               order: Optional[str]=None) -> List[str]:
     """
     Return a de-duplicated list of files in 'directory' matching the given glob pattern(s).
-    If recursive is True, includes subdirectories.
+    'directory' may also be a list of root directories, which are listed in order.
+    If recursive is True, includes subdirectories; symlinked subdirectories are only
+    entered with follow_links=True, and every directory is entered at most once.
+    Paths leading to the same file (hard links, symlinks) are listed once.
+    If file_filter is given, files whose metadata it rejects are left out.
+    'order' (a FILE_ORDERS key: 'mtime-desc', 'size-asc', 'path') sorts the result,
+    which is the order files are scheduled in; None keeps discovery order.
+    """
+    if order is not None and order not in FILE_ORDERS:
+        raise ValueError(f"unknown order: {order!r}")
+    files = _collect_files(directory, file_patterns, recursive, file_filter, follow_links)
+    if order is not None:
+        files.sort(key=FILE_ORDERS[order])
+    return [p for p, _ in files]
+
+def _walk_files(root: str, patterns: List[str], recursive: bool, follow_links: bool,
+                visited: set) -> Generator[str, None, None]:
+    """
+    Yield the paths under 'root' whose names match one of 'patterns', directory by
+    directory in pre-order like a recursive glob (names starting with '.' only match
+    patterns that do too, hidden directories are not entered).
+    Directories already in 'visited' (st_dev, st_ino) are skipped, so symlink loops end.
+    """
+    stack = [root]
+    while stack:
+        d = stack.pop()
+        try:
+            st = os.stat(d)
+            if st.st_ino:
+                if (st.st_dev, st.st_ino) in visited:
+                    continue
+                visited.add((st.st_dev, st.st_ino))
+            with os.scandir(d) as it:
+                entries = list(it)
+        except OSError:
+            continue
+        subdirs = []
+        for entry in entries:
+            name = entry.name
+            if any(fnmatch.fnmatch(name, p) for p in patterns if name[0] != "." or p[0] == "."):
+                yield entry.path
+            if recursive and name[0] != ".":
+                try:
+                    if entry.is_dir() and (follow_links or not entry.is_symlink()):
+                        subdirs.append(entry.path)
+                except OSError:
+                    pass
+        stack.extend(reversed(subdirs))
+
+def _collect_files(directory: Union[str, List[str]], file_patterns: Union[str, List[str]], recursive: bool=False,
+                   file_filter: Optional[FileFilter]=None, follow_links: bool=False) -> List[Tuple[str, os.stat_result]]:
+    """
+    Like iter_files, but returns (path, stat_result) pairs; each file is stat'ed exactly once.
     """
-    directory = _normalize_dir(directory)
     patterns = [file_patterns] if isinstance(file_patterns, str) else list(file_patterns)
+    # patterns naming subdirectories ('src/*.py') still go through glob
+    name_patterns = [p for p in patterns if "/" not in p and os.sep not in p]
+    path_patterns = [p for p in patterns if p not in name_patterns]
 
+    visited: set = set()
     files = []
-    for pattern in patterns:
-        if recursive:
-            glob_pattern = os.path.join(directory, "**", pattern)
-            files.extend(glob.glob(glob_pattern, recursive=True))
-        else:
-            glob_pattern = os.path.join(directory, pattern)
-            files.extend(glob.glob(glob_pattern))
+    for root in _normalize_dirs(directory):
+        if name_patterns:
+            files.append(_walk_files(root, name_patterns, recursive, follow_links, visited))
+        for pattern in path_patterns:
+            if recursive:
+                glob_pattern = os.path.join(root, "**", pattern)
+                files.append(glob.iglob(glob_pattern, recursive=True))
+            else:
+                glob_pattern = os.path.join(root, pattern)
+                files.append(glob.iglob(glob_pattern))
 
-    # keep unique existing files only
+    # keep unique existing files only, by path and by (st_dev, st_ino)
     seen = set()
+    seen_inodes = set()
     uniq = []
-    for p in files:
-        if os.path.isfile(p) and p not in seen:
-            uniq.append(p)
-            seen.add(p)
+    for p in itertools.chain.from_iterable(files):
+        if p in seen:
+            continue
+        seen.add(p)
+        try:
+            st = os.stat(p)
+        except OSError:
+            continue
+        if not stat.S_ISREG(st.st_mode):
+            continue
+        if st.st_ino:
+            # some file systems (e.g. FAT on Windows) report no inode numbers
+            if (st.st_dev, st.st_ino) in seen_inodes:
+                continue
+            seen_inodes.add((st.st_dev, st.st_ino))
+        if file_filter and not file_filter(st):
+            continue
+        uniq.append((p, st))
     return uniq
 
+def find_duplicates(files: List[str], block_size: int=DEFAULT_BLOCK_SIZE) -> Dict[str, List[str]]:
+    """
+    Group byte-identical files: returns {first path: [later paths with the same content]}
+    for every content shared by more than one file in 'files'.
+    Only files whose sizes collide are hashed; unreadable files are left alone.
+    """
+    by_size: Dict[int, List[str]] = {}
+    for p in files:
+        try:
+            by_size.setdefault(os.stat(p).st_size, []).append(p)
+        except OSError:
+            continue
+
+    duplicates: Dict[str, List[str]] = {}
+    for paths in by_size.values():
+        if len(paths) < 2:
+            continue
+        by_hash: Dict[bytes, List[str]] = {}
+        for p in paths:
+            digest = hashlib.sha256()
+            try:
+                with _open_binary(p) as f:
+                    for block in iter(lambda: f.read(block_size), b""):
+                        digest.update(block)
+            except OSError:
+                continue
+            by_hash.setdefault(digest.digest(), []).append(p)
+        for same in by_hash.values():
+            if len(same) > 1:
+                duplicates[same[0]] = same[1:]
+    return duplicates
+
+# ------------------ Reading layer ------------------
+
+class RateLimiter:
+    """
+    Thread-safe token bucket: consume(n) blocks until n bytes fit under 'rate' bytes/s.
+    Reads are expected in chunks of about 'burst' bytes (see chunk), which keeps the
+    pace smooth instead of reading a large block and then sleeping for a long time.
+    """
+    def __init__(self, rate: float, burst: Optional[float]=None):
+        self.rate = float(rate)
+        self.burst = burst if burst is not None else max(4096.0, self.rate / 20)
+        self.tokens = self.burst
+        self.stamp = time.monotonic()
+        self.lock = threading.Lock()
+
+    @property
+    def chunk(self) -> int:
+        return int(self.burst)
+
+    def consume(self, n: int):
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+            self.stamp = now
+            # callers reserve their share first and then sleep it off, so threads queue up fairly
+            self.tokens -= n
+            wait = -self.tokens / self.rate
+        if wait > 0:
+            time.sleep(wait)
+
+def _read_full(raw, size: int) -> bytes:
+    """
+    Read 'size' bytes, or fewer only at the end of the file. Readers in this module
+    may return short reads (the throttled reader caps each read at its chunk size).
+    """
+    parts = []
+    while size > 0:
+        data = raw.read(size)
+        if not data:
+            break
+        parts.append(data)
+        size -= len(data)
+    return b"".join(parts)
+
+class _ThrottledReader:
+    """
+    Binary reader that paces reads through a RateLimiter.
+    """
+    def __init__(self, raw, limiter: RateLimiter):
+        self.raw = raw
+        self.limiter = limiter
+
+    def read(self, size: int=-1) -> bytes:
+        if size < 0 or size > self.limiter.chunk:
+            size = self.limiter.chunk
+        data = self.raw.read(size)
+        self.limiter.consume(len(data))
+        return data
+
+    def seek(self, offset: int, whence: int=os.SEEK_SET) -> int:
+        return self.raw.seek(offset, whence)
+
+    def tell(self) -> int:
+        return self.raw.tell()
+
+# posix_fadvise is missing on Windows and macOS; the hints below are skipped there
+_FADVISE = hasattr(os, "posix_fadvise")
+
+def _fadvise(fd: int, offset: int, length: int, advice: str):
+    """
+    Pass an access pattern hint (e.g. 'POSIX_FADV_WILLNEED') for a byte range to the kernel.
+    Hints are advisory, so failures (unsupported file system, ...) are ignored.
+    """
+    if _FADVISE:
+        with contextlib.suppress(OSError):
+            os.posix_fadvise(fd, offset, length, getattr(os, advice))
+
+class _ReadaheadReader:
+    """
+    Buffered binary reader that keeps one 'window' of the file requested from the
+    kernel (POSIX_FADV_WILLNEED) ahead of the reader, so storage fetches the next
+    buffer while the current one is matched. After a seek the hints pause until a
+    window has been read sequentially, so bisecting a file does not fetch windows
+    around every probe.
+    """
+    def __init__(self, f, window: int):
+        self.f = f
+        self.fd = f.fileno()
+        self.window = window
+        self.pos = 0
+        self.hinted = 0
+
+    def read(self, size: int=-1) -> bytes:
+        data = self.f.read(size)
+        self.pos += len(data)
+        if data and self.pos + self.window > self.hinted:
+            start = max(self.pos, self.hinted)
+            _fadvise(self.fd, start, self.window, "POSIX_FADV_WILLNEED")
+            self.hinted = start + self.window
+        return data
+
+    def seek(self, offset: int, whence: int=os.SEEK_SET) -> int:
+        self.pos = self.f.seek(offset, whence)
+        self.hinted = self.pos + 2 * self.window
+        return self.pos
+
+    def tell(self) -> int:
+        return self.pos
+
+class IOLimits:
+    """
+    Settings applied to every file the searcher reads: a token bucket capping the
+    total read rate (bytes/s), a cap on the number of files open at once (None
+    disables a limit), the read buffer size and whether to drop the file's pages
+    from the OS cache once it has been read.
+
+    Where the OS supports posix_fadvise, files are read with the SEQUENTIAL hint
+    and a window of readahead (see _ReadaheadReader), and prefetch() asks for the
+    start of the next file in a background thread.
+
+    With a read rate limit the token bucket only sees what leaves the buffer, so
+    the buffer, the readahead and the prefetch window shrink to one limiter chunk
+    and the SEQUENTIAL hint is left out; storage is then read at the limited pace.
+    """
+    def __init__(self, max_read_rate: Optional[float]=None, max_open_files: Optional[int]=None,
+                 buffer_size: int=DEFAULT_READ_BUFFER, drop_cache: bool=False):
+        self.limiter = RateLimiter(max_read_rate) if max_read_rate else None
+        self.slots = threading.BoundedSemaphore(max_open_files) if max_open_files else None
+        self.buffer_size = min(buffer_size, self.limiter.chunk) if self.limiter is not None else buffer_size
+        self.drop_cache = drop_cache
+        self._prefetch: "queue.Queue[str]" = queue.Queue(maxsize=64)
+        self._prefetcher: Optional[threading.Thread] = None
+        self._prefetch_lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def open_file(self, file_path: str):
+        """
+        Open file_path for binary reading, waiting for a free slot first.
+        """
+        if self.slots is not None:
+            self.slots.acquire()
+        try:
+            fd = os.open(file_path, os.O_RDONLY | getattr(os, "O_BINARY", 0))
+            try:
+                # small files get a buffer of their own size
+                size = os.fstat(fd).st_size
+                f = open(fd, "rb", buffering=max(io.DEFAULT_BUFFER_SIZE, min(self.buffer_size, size + 1)))
+            except BaseException:
+                os.close(fd)
+                raise
+            with f:
+                reader = f
+                if _FADVISE:
+                    if self.limiter is None:
+                        _fadvise(fd, 0, 0, "POSIX_FADV_SEQUENTIAL")
+                    reader = _ReadaheadReader(f, self.buffer_size)
+                try:
+                    yield _ThrottledReader(reader, self.limiter) if self.limiter is not None else reader
+                finally:
+                    if self.drop_cache:
+                        _fadvise(fd, 0, 0, "POSIX_FADV_DONTNEED")
+        finally:
+            if self.slots is not None:
+                self.slots.release()
+
+    def prefetch(self, file_path: str):
+        """
+        Ask the kernel in a background thread to start reading the first buffer of a
+        file that is about to be scanned. Does nothing without posix_fadvise or when
+        the queue of pending requests is full.
+        """
+        if not _FADVISE:
+            return
+        with self._prefetch_lock:
+            if self._prefetcher is None:
+                self._prefetcher = threading.Thread(target=self._prefetch_worker, daemon=True)
+                self._prefetcher.start()
+        with contextlib.suppress(queue.Full):
+            self._prefetch.put_nowait(file_path)
+
+    def _prefetch_worker(self):
+        while True:
+            file_path = self._prefetch.get()
+            # never wait for an open-file slot on behalf of a file nobody reads yet
+            if self.slots is not None and not self.slots.acquire(blocking=False):
+                continue
+            try:
+                fd = os.open(file_path, os.O_RDONLY)
+                try:
+                    _fadvise(fd, 0, self.buffer_size, "POSIX_FADV_WILLNEED")
+                finally:
+                    os.close(fd)
+            except OSError:
+                pass
+            finally:
+                if self.slots is not None:
+                    self.slots.release()
+
+_io_limits = IOLimits()
+
+def set_io_limits(max_read_rate: Optional[float]=None, max_open_files: Optional[int]=None,
+                  buffer_size: int=DEFAULT_READ_BUFFER, drop_cache: bool=False):
+    """
+    Set the process-wide read settings (see IOLimits); call without arguments to restore the defaults.
+    """
+    global _io_limits
+    _io_limits = IOLimits(max_read_rate, max_open_files, buffer_size, drop_cache)
+
+def _open_binary(file_path: str):
+    return _io_limits.open_file(file_path)
+
+def lower_priority() -> bool:
+    """
+    Lower the CPU and I/O priority of this process so a search yields to other work.
+    Returns False if the platform refused or offers no way to do it.
+    """
+    if sys.platform.startswith("win"):
+        import ctypes
+        kernel32 = ctypes.windll.kernel32  # type: ignore[attr-defined]
+        # PROCESS_MODE_BACKGROUND_BEGIN lowers CPU, I/O and memory priority together
+        return bool(kernel32.SetPriorityClass(kernel32.GetCurrentProcess(), 0x00100000))
+    lowered = False
+    try:
+        os.nice(10)
+        lowered = True
+    except (AttributeError, OSError):
+        pass
+    ionice = shutil.which("ionice")
+    if ionice:
+        # best-effort class, lowest level: still served on a busy disk, unlike the idle class
+        try:
+            if subprocess.call([ionice, "-c", "2", "-n", "7", "-p", str(os.getpid())],
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL) == 0:
+                lowered = True
+        except OSError:
+            pass
+    return lowered
+
+# ------------------ Block scanner ------------------
+
+# Hit = (line_number, column, byte_offset, snippet, clipped, field)
+# 'field' locates structured hits (CSV '/row/column', JSON pointer) and is '' for plain text
+Hit = Tuple[int, int, int, str, bool, str]
+
+def _byte_len(text: str, enc: str, errors: str) -> int:
+    return len(text) if text.isascii() else len(text.encode(enc, errors))
+
+def _decode_window(data: bytes, enc: str, errors: str, final: bool) -> str:
+    # an incremental decoder leaves a trailing partial character in 'data' undecoded
+    return codecs.getincrementaldecoder(enc)(errors).decode(data, final)
+
+def _clip(line: str, col: int, mlen: int) -> Tuple[str, bool]:
+    """
+    Return (snippet, clipped) for a complete line with a match at 'col'.
+    """
+    if line.endswith("\r"):
+        line = line[:-1]
+    if len(line) <= MAX_LINE_CHARS:
+        return line, False
+    return line[max(0, col - SNIPPET_CONTEXT):col + mlen + SNIPPET_CONTEXT], True
+
+def _encoding_index(encoding: Optional[str]) -> int:
+    for i, (enc, _) in enumerate(_ENCODINGS):
+        if enc == encoding:
+            return i
+    return 0
+
+def iter_hits(raw, search_string: str, case_sensitive: bool=False,
+              block_size: int=DEFAULT_BLOCK_SIZE, encoding: Optional[str]=None,
+              live: bool=False) -> Generator[Hit, None, str]:
+    """
+    Scan the binary stream 'raw' block by block and yield a Hit
+    (line_number, column, byte_offset, snippet, clipped, '') for the first match on each
+    matching line. 'column' is 1-based in characters, 'byte_offset' points at the match.
+
+    Lines up to MAX_LINE_CHARS are reported whole; for longer lines the snippet is
+    a window of SNIPPET_CONTEXT characters around the match and 'clipped' is True.
+    Memory stays bounded by the block size however long a line is.
+    Decoding tries utf-8 first (or 'encoding' if given) and switches to gbk for
+    the rest of the stream on the first invalid sequence. The generator returns
+    the encoding it ended with.
+    With 'live' every complete line is scanned as soon as it has been read instead
+    of waiting for the next block, for streams that may pause (pipes, tail -f).
+    """
+    needle = search_string if case_sensitive else search_string.lower()
+    rx = None if case_sensitive else re.compile(re.escape(search_string), re.IGNORECASE)
+    lookahead = max(MAX_LINE_CHARS, len(needle) + SNIPPET_CONTEXT)
+
+    enc_index = _encoding_index(encoding)
+    data = b""
+    scan_pos = 0      # chars of the window already scanned
+    scan_bytes = 0    # the same position in bytes, to re-sync after an encoding switch
+    scan_line = 1     # line number at scan_pos
+    win_col = 0       # column of the window start within its line
+    win_byte = 0      # file offset of the window start
+    skip_rest = False # the line at scan_pos has already been reported
+    eof = False
+
+    while not eof:
+        block = raw.read(block_size)
+        eof = not block
+        data = data + block if data else block
+
+        while True:
+            enc, errors = _ENCODINGS[enc_index]
+            try:
+                text = _decode_window(data, enc, errors, eof)
+                break
+            except UnicodeDecodeError:
+                enc_index += 1
+                enc, errors = _ENCODINGS[enc_index]
+                scan_pos = len(_decode_window(data[:scan_bytes], enc, errors, False))
+
+        hay = text if case_sensitive else text.lower()
+        if len(hay) != len(text):
+            # lower() changed the length (rare special casing), positions would drift
+            hay = None
+
+        def _find(start):
+            if hay is not None:
+                return hay.find(needle, start), len(needle)
+            m = rx.search(text, start)
+            return (m.start(), m.end() - m.start()) if m else (-1, 0)
+
+        if eof:
+            limit = len(text)
+        else:
+            limit = max(scan_pos, len(text) - lookahead)
+            # stop at a line boundary when possible so the next window starts on a fresh line
+            cut = text.rfind("\n", scan_pos, len(text) if live else limit) + 1
+            if cut > scan_pos:
+                limit = cut
+        pos = scan_pos
+        cur_pos, cur_line = scan_pos, scan_line
+        byte_pos, byte_count = 0, 0
+
+        # Dense hits: split the complete lines once and test them in a comprehension
+        # instead of hopping from hit to hit.
+        dense_end = text.rfind("\n", pos, limit) + 1
+        if (hay is not None and not skip_rest and dense_end > pos
+                and (text[pos - 1] == "\n" if pos else win_col == 0)
+                and hay.count(needle, pos, dense_end) * 8 > text.count("\n", pos, dense_end)):
+            region = text[pos:dense_end]
+            lines = region.split("\n")
+            lines.pop()
+            hay_lines = lines if case_sensitive else hay[pos:dense_end].split("\n")[:-1]
+            region_bytes = _byte_len(region, enc, errors)
+            byte_count += _byte_len(text[:pos], enc, errors)
+            sizes = lines if region.isascii() else data[byte_count:byte_count + region_bytes].split(b"\n")
+            # byte offset of every line start in the region (+1 per newline)
+            offsets = list(itertools.accumulate(map(len, sizes), initial=win_byte + byte_count))
+            for i in [i for i, h in enumerate(hay_lines) if needle in h]:
+                line = lines[i]
+                col = hay_lines[i].find(needle)
+                if len(line) <= MAX_LINE_CHARS and line[-1:] != "\r":
+                    snippet, clipped = line, False
+                else:
+                    snippet, clipped = _clip(line, col, len(needle))
+                if errors == "surrogateescape":
+                    snippet = _SURROGATES.sub("", snippet)
+                offset = offsets[i] + i + (col if sizes is lines else _byte_len(line[:col], enc, errors))
+                yield cur_line + i, col + 1, offset, snippet, clipped, ""
+            cur_line += len(lines)
+            cur_pos = byte_pos = pos = dense_end
+            byte_count += region_bytes
+
+        while pos < limit:
+            if skip_rest:
+                nl = text.find("\n", pos, limit)
+                if nl < 0:
+                    pos = limit
+                    break
+                pos = nl + 1
+                skip_rest = False
+                continue
+            p, mlen = _find(pos)
+            if p < 0 or p >= limit:
+                pos = limit
+                break
+
+            nl = text.rfind("\n", 0, p)
+            ls = nl + 1
+            col = p - ls if nl >= 0 else win_col + p
+            le = text.find("\n", p)
+            line_end = le if le >= 0 else len(text)
+            if line_end > p and text[line_end - 1] == "\r":
+                line_end -= 1
+            if (nl >= 0 or win_col == 0) and (le >= 0 or eof) and line_end - ls <= MAX_LINE_CHARS:
+                snippet, clipped = text[ls:line_end], False
+            else:
+                start = max(ls, p - SNIPPET_CONTEXT)
+                snippet, clipped = text[start:min(line_end, p + mlen + SNIPPET_CONTEXT)], True
+            if errors == "surrogateescape":
+                snippet = _SURROGATES.sub("", snippet)
+
+            cur_line += text.count("\n", cur_pos, p)
+            cur_pos = p
+            byte_count += _byte_len(text[byte_pos:p], enc, errors)
+            byte_pos = p
+            yield cur_line, col + 1, win_byte + byte_count, snippet, clipped, ""
+
+            if le >= 0:
+                pos = le + 1
+            else:
+                pos = limit
+                skip_rest = True
+
+        if eof:
+            break
+
+        # keep the unfinished line (or, inside a very long line, just the context) for the next block
+        end = max(pos, limit)
+        ls = text.rfind("\n", 0, end) + 1
+        if (ls > 0 or win_col == 0) and end - ls <= MAX_LINE_CHARS:
+            keep = ls
+        else:
+            keep = max(0, end - SNIPPET_CONTEXT)
+        nl = text.rfind("\n", 0, keep)
+        win_col = keep - (nl + 1) if nl >= 0 else win_col + keep
+        scan_line = cur_line + text.count("\n", cur_pos, end)
+        keep_bytes = _byte_len(text[:keep], enc, errors)
+        scan_bytes = _byte_len(text[keep:end], enc, errors)
+        scan_pos = end - keep
+        win_byte += keep_bytes
+        data = data[keep_bytes:]
+    return _ENCODINGS[enc_index][0]
+
 def iter_matches(file_path: str, search_string: str, case_sensitive: bool=False) -> Generator[Tuple[int, str], None, None]:
     """
     Yield (line_number, line_text) for each matching line in file_path.
-    Tries utf-8 first, then falls back to gbk and latin-1.
+    Overlong lines are shortened to a window around the match (see iter_hits).
+    Tries utf-8 first, then falls back to gbk.
+    """
+    with _open_binary(file_path) as f:
+        for hit in iter_hits(f, search_string, case_sensitive):
+            yield hit[0], hit[3]
+
+# ------------------ Multi-line patterns ------------------
+
+# Longest match the multi-line scanner guarantees to find in full (characters);
+# the buffer always looks this far ahead of the position being searched
+MULTILINE_MAX_SPAN = 64 * 1024
+# Matches spanning up to this many characters (whole lines) are reported in full
+MULTILINE_SNIPPET_CHARS = 4 * MAX_LINE_CHARS
+
+def compile_pattern(search_string: str, case_sensitive: bool=False, regex: bool=False) -> "re.Pattern":
+    """
+    Compile the term of a multi-line search. A regular expression is used as given
+    (with re.MULTILINE, so ^/$ match at line boundaries); in a literal, a line break
+    may be written as a real newline or as the two characters '\n' and matches both
+    LF and CRLF line endings.
+    """
+    flags = re.MULTILINE | (0 if case_sensitive else re.IGNORECASE)
+    if regex:
+        return re.compile(search_string, flags)
+    parts = re.split(r"\\n|\r?\n", search_string)
+    return re.compile(r"\r?\n".join(re.escape(part) for part in parts), flags)
+
+def iter_multiline_hits(raw, pattern: "re.Pattern", block_size: int=DEFAULT_BLOCK_SIZE,
+                        encoding: Optional[str]=None, max_span: int=MULTILINE_MAX_SPAN,
+                        first_line: Optional[int]=1) -> Generator[Hit, None, str]:
+    """
+    Scan the binary stream 'raw' in a single pass for matches of 'pattern' that may
+    span line breaks, and yield one Hit per (non-empty, non-overlapping) match.
+
+    The decoded text is kept in a sliding buffer: a block is only searched up to
+    'max_span' characters before its end, so a match that crosses the block edge is
+    found whole once the next block has arrived. Matches longer than 'max_span' are
+    cut short. Memory stays bounded by block_size + max_span.
+
+    Line and column point at the start of the match. A match over several lines gets
+    field 'to line N' (its end line) and its snippet holds the matched lines joined by
+    '\n' (a window around the match when they exceed MULTILINE_SNIPPET_CHARS).
+    With first_line None the line numbers are unknown (a slice of a file): lines are 0
+    and the field reads 'N lines'. Decoding is the same as iter_hits; the generator
+    returns the encoding it ended with.
+    """
+    keep = MULTILINE_SNIPPET_CHARS
+    buf = ""
+    marks: List[Tuple[int, int, str, str]] = []  # (buffer index, byte offset, encoding, errors) of each block start
+    total_bytes = 0
+    buf_col = 0       # column of buf[0] within its line
+    line_pos, line_no = 0, first_line or 1  # line number at buffer index line_pos
+    pos = 0           # next search position
+    enc = _ENCODINGS[_encoding_index(encoding)][0]
+    errors = "strict"
+
+    def _byte_at(i: int) -> int:
+        for start, offset, m_enc, m_errors in reversed(marks):
+            if start <= i:
+                return offset + _byte_len(buf[start:i], m_enc, m_errors)
+        return total_bytes
+
+    blocks = _iter_text_blocks(raw, block_size, encoding)
+    eof = False
+    while not eof:
+        chunk = next(blocks, None)
+        if chunk is None:
+            eof = True
+        else:
+            text, enc, errors = chunk
+            marks.append((len(buf), total_bytes, enc, errors))
+            total_bytes += _byte_len(text, enc, errors)
+            buf += text
+        limit = len(buf) if eof else len(buf) - max_span
+
+        while pos < limit:
+            m = pattern.search(buf, pos)
+            if m is None or m.start() >= limit:
+                break
+            start, end = m.span()
+            if start == end:
+                pos = start + 1
+                continue
+            pos = end
+
+            line_no += buf.count("\n", line_pos, start)
+            line_pos = start
+            last = max(start, end - 1)
+            end_line = line_no + buf.count("\n", start, last)
+            ls = buf.rfind("\n", 0, start) + 1
+            col = start - ls if ls or buf_col == 0 else buf_col + start
+            le = buf.find("\n", last)
+            if le < 0:
+                le = len(buf)
+            if (ls or buf_col == 0) and (le < len(buf) or eof) and le - ls <= MULTILINE_SNIPPET_CHARS:
+                snippet, clipped = buf[ls:le], False
+            else:
+                snippet = buf[max(ls, start - SNIPPET_CONTEXT):min(le, end + SNIPPET_CONTEXT, start + MULTILINE_SNIPPET_CHARS)]
+                clipped = True
+            snippet = snippet.replace("\r\n", "\n").rstrip("\r")
+            if errors == "surrogateescape":
+                snippet = _SURROGATES.sub("", snippet)
+            field = ""
+            if end_line > line_no:
+                field = f"至第 {end_line} 行" if first_line else f"共 {end_line - line_no + 1} 行"
+            yield (line_no if first_line else 0), col + 1, _byte_at(start), snippet, clipped, field
+
+        if eof:
+            break
+        pos = max(pos, limit)
+        # drop what can no longer be part of a match or of a snippet
+        cut = pos - keep
+        if cut > 0:
+            line_no += buf.count("\n", line_pos, cut)
+            line_pos = max(line_pos, cut) - cut
+            nl = buf.rfind("\n", 0, cut)
+            buf_col = cut - nl - 1 if nl >= 0 else buf_col + cut
+            current = next(mk for mk in reversed(marks) if mk[0] <= cut)
+            marks = [(0, _byte_at(cut), current[2], current[3])] + [
+                (i - cut, offset, m_enc, m_errors) for i, offset, m_enc, m_errors in marks if i > cut]
+            buf = buf[cut:]
+            pos -= cut
+    return enc
+
+# ------------------ Time windows ------------------
+
+# Timestamp formats tried at the start of a line (after '[' and blanks), see TimeWindow
+DEFAULT_TIME_FORMATS = ("%Y-%m-%dT%H:%M:%S", "%Y-%m-%d %H:%M:%S", "%Y/%m/%d %H:%M:%S", "%d/%b/%Y:%H:%M:%S")
+# Bytes examined per probe when looking for the next timestamped line
+_TIME_PROBE = 64 * 1024
+# Bytes of a line handed to the timestamp parser
+_TIME_PREFIX = 64
+
+class TimeWindow:
+    """
+    Restricts plain-text search to the lines of a timestamp-sorted log between 'since'
+    and 'until' (POSIX timestamps or parse_time strings such as '1d', None = open end).
+    'spec' keeps them as given, so a relative window can be recognized on a later run.
+
+    Lines are dated by a timestamp at their start, parsed with the first matching
+    strptime format (fixed width, e.g. '%Y-%m-%d %H:%M:%S'; trailing fractions or zones
+    are ignored and times are taken as local time). Lines without a timestamp belong
+    to the entry above them. The window is found by binary search over byte offsets,
+    so only the matching slice of a file is read.
+    """
+    def __init__(self, since: Union[float, str, None]=None, until: Union[float, str, None]=None,
+                 formats: Optional[List[str]]=None):
+        self.spec = [since, until]
+        self.since = parse_time(since) if isinstance(since, str) else since
+        self.until = parse_time(until) if isinstance(until, str) else until
+        sample = datetime.datetime(2000, 12, 28, 23, 59, 59, 999999)
+        self.formats = [(fmt, len(sample.strftime(fmt))) for fmt in (formats or DEFAULT_TIME_FORMATS)]
+
+    def line_time(self, line: bytes) -> Optional[float]:
+        """
+        Timestamp at the start of 'line', or None.
+        """
+        text = line[:_TIME_PREFIX].decode("ascii", "replace").lstrip(" \t[")
+        for fmt, width in self.formats:
+            try:
+                return datetime.datetime.strptime(text[:width], fmt).timestamp()
+            except ValueError:
+                continue
+        return None
+
+    def _first_timed_line(self, f, pos: int) -> Optional[Tuple[int, float]]:
+        """
+        (offset, time) of the first timestamped line starting at or after byte 'pos',
+        looking no further than _TIME_PROBE bytes. Reads start small and grow, since
+        the next timestamp is usually within the first few lines.
+        """
+        base = max(0, pos - 1)
+        f.seek(base)
+        data = b""
+        # next line start to examine; for pos > 0 first resync to the byte after a newline
+        i = 0 if pos == 0 else None
+        scan = 0
+        size = 4096
+        while True:
+            chunk = _read_full(f, size)
+            data += chunk
+            eof = len(chunk) < size
+            while True:
+                if i is None:
+                    nl = data.find(b"\n", scan)
+                    if nl < 0:
+                        scan = len(data)
+                        break
+                    i = nl + 1
+                if i >= len(data) or (not eof and i + _TIME_PREFIX > len(data)):
+                    break
+                t = self.line_time(data[i:i + _TIME_PREFIX])
+                if t is not None:
+                    return base + i, t
+                scan, i = i, None
+            if eof or len(data) >= _TIME_PROBE:
+                return None
+            size = min(size * 2, _TIME_PROBE)
+
+    def _last_time(self, f, size: int) -> Optional[float]:
+        start = max(0, size - _TIME_PROBE)
+        f.seek(start)
+        lines = _read_full(f, _TIME_PROBE).split(b"\n")
+        if start:
+            lines = lines[1:]
+        for line in reversed(lines):
+            t = self.line_time(line)
+            if t is not None:
+                return t
+        return None
+
+    def _bisect(self, f, size: int, reached: Callable[[float], bool]) -> int:
+        """
+        Offset of the first timestamped line whose time satisfies 'reached' (size if none).
+        """
+        lo, hi = 0, size
+        while lo < hi:
+            mid = (lo + hi) // 2
+            found = self._first_timed_line(f, mid)
+            if found is None or reached(found[1]):
+                hi = mid
+            else:
+                lo = mid + 1
+        found = self._first_timed_line(f, lo)
+        return found[0] if found is not None else size
+
+    def locate(self, f, size: int) -> Optional[Tuple[int, int]]:
+        """
+        Byte range [start, end) of the seekable binary file 'f' inside the window, or None
+        when the file has no timestamps or its first and last ones lie outside the window.
+        """
+        first = self._first_timed_line(f, 0)
+        if first is None:
+            return None
+        if self.until is not None and first[1] > self.until:
+            return None
+        if self.since is not None:
+            last = self._last_time(f, size)
+            if last is not None and last < self.since:
+                return None
+        start = 0 if self.since is None else self._bisect(f, size, lambda t: t >= self.since)
+        end = size if self.until is None else self._bisect(f, size, lambda t: t > self.until)
+        return (start, end) if start < end else None
+
+class _SliceReader:
+    """
+    Binary reader over bytes [start, end) of a seekable file.
+    """
+    def __init__(self, raw, start: int, end: int):
+        raw.seek(start)
+        self.raw = raw
+        self.remaining = end - start
+
+    def read(self, size: int=-1) -> bytes:
+        if self.remaining <= 0:
+            return b""
+        data = self.raw.read(self.remaining if size < 0 else min(size, self.remaining))
+        self.remaining -= len(data)
+        return data
+
+def _rebase_hits(hits: Generator[Hit, None, str], base: int) -> Generator[Hit, None, str]:
+    """
+    Turn hits of a slice starting at byte 'base' into file hits: offsets are shifted and,
+    since the lines before the slice were never read, line numbers become 0 (unknown).
     """
+    while True:
+        try:
+            hit = next(hits)
+        except StopIteration as stop:
+            return stop.value
+        yield (0, hit[1], hit[2] + base) + hit[3:]
+
+# ------------------ Structured (CSV / JSON) search ------------------
+
+_CSV_EXTENSIONS = (".csv", ".tsv")
+_JSON_EXTENSIONS = (".json", ".jsonl", ".ndjson")
+# Longest JSON string value that is decoded and matched as a whole; longer ones are matched raw
+MAX_JSON_VALUE_CHARS = 1024 * 1024
+
+class ScanOptions:
+    """
+    Per-file scanning options shared by the CLI, the GUI and scan_files.
+
+    csv_columns: CSV columns to search (header names or 1-based numbers); applies to *.csv/*.tsv.
+    csv_header:  the first CSV record is a header (never matched); False for headerless files.
+    json_paths:  key paths to search (e.g. 'items.*.name', '/items/*/name', '**.message');
+                 applies to *.json/*.jsonl/*.ndjson.
+    Other files, or all files when no selector is given, are searched as plain text.
+    max_hits:    stop reading a file after this many hits.
+    time_window: TimeWindow limiting plain-text search to a slice of timestamped logs.
+    multiline:   plain-text matches may span line breaks (see compile_pattern, iter_multiline_hits).
+    regex:       the search string is a regular expression (implies the multi-line scanner).
+    checkpoint:  Checkpoint recording how far each file has been scanned, so an interrupted
+                 search can resume (see search_in_files).
+    encoding_cache: dict (path -> encoding) filled with the encoding each scanned file
+                 turned out to use, and consulted to skip the utf-8 attempt next time.
+    cancel:      threading.Event; once set, files being read are treated as ended.
+    """
+    def __init__(self, csv_columns: Optional[List[str]]=None, json_paths: Optional[List[str]]=None,
+                 block_size: int=DEFAULT_BLOCK_SIZE, encoding_cache: Optional[Dict[str, str]]=None,
+                 cancel: Optional[threading.Event]=None, max_hits: Optional[int]=None,
+                 time_window: Optional["TimeWindow"]=None, multiline: bool=False, regex: bool=False,
+                 checkpoint: Optional["Checkpoint"]=None, csv_header: bool=True):
+        self.csv_columns = list(csv_columns or [])
+        self.csv_header = csv_header
+        self.json_paths = [parse_json_path(p) for p in (json_paths or [])]
+        self.block_size = block_size
+        self.encoding_cache = encoding_cache
+        self.cancel = cancel
+        self.max_hits = max_hits
+        self.time_window = time_window
+        self.multiline = multiline
+        self.regex = regex
+        self.checkpoint = checkpoint
+
+def _iter_text_blocks(raw, block_size: int, encoding: Optional[str]=None) -> Generator[Tuple[str, str, str], None, None]:
+    """
+    Decode the binary stream 'raw' block by block and yield (text, encoding, errors).
+    Starts with utf-8 (or 'encoding') and switches to gbk for the rest of the stream
+    on the first invalid sequence.
+    """
+    enc_index = _encoding_index(encoding)
+    pending = b""
+    eof = False
+    while not eof:
+        block = raw.read(block_size)
+        eof = not block
+        data = pending + block
+        while True:
+            enc, errors = _ENCODINGS[enc_index]
+            decoder = codecs.getincrementaldecoder(enc)(errors)
+            try:
+                text = decoder.decode(data, eof)
+                break
+            except UnicodeDecodeError:
+                enc_index += 1
+        pending = decoder.getstate()[0]
+        if text:
+            yield text, enc, errors
+
+def _matcher(search_string: str, case_sensitive: bool):
     needle = search_string if case_sensitive else search_string.lower()
+    if case_sensitive:
+        return needle, lambda s: s
+    return needle, str.lower
 
-    def _scan(handle):
-        for i, line in enumerate(handle, 1):
-            hay = line if case_sensitive else line.lower()
-            if needle in hay:
-                yield i, line.rstrip("\n")
+# ---- CSV ----
 
+def _iter_csv_hits(raw, search_string: str, case_sensitive: bool, columns: List[str],
+                   block_size: int=DEFAULT_BLOCK_SIZE, encoding: Optional[str]=None,
+                   header: bool=True) -> Generator[Hit, None, Optional[str]]:
+    """
+    Stream a CSV file row by row and yield a hit for each record whose selected
+    columns contain the search string. 'field' is '/<row>/<column>' (row 1 = first data row),
+    line/column/offset point at the match inside the record. The first record is the
+    header and is never matched, however the columns are selected; with header=False
+    every record is data and only numbered columns can be selected.
+    Returns the encoding the file was decoded with.
+    """
+    needle, fold = _matcher(search_string, case_sensitive)
+    # physical lines not yet attributed to a record: (text, byte offset, encoding, errors)
+    consumed: "collections.deque[Tuple[str, int, str, str]]" = collections.deque()
+    detected = [encoding]
+
+    def _lines():
+        offset = 0
+        carry = ""
+        for text, enc, errors in _iter_text_blocks(raw, block_size, encoding):
+            detected[0] = enc
+            parts = (carry + text).split("\n")
+            carry = parts.pop()
+            for part in parts:
+                line = part + "\n"
+                consumed.append((line, offset, enc, errors))
+                offset += _byte_len(line, enc, errors)
+                yield line
+        if carry:
+            consumed.append((carry, offset, enc, errors))
+            yield carry
+
+    lines = _lines()
+    first = next(lines, None)
+    if first is None:
+        return
     try:
-        with open(file_path, "r", encoding="utf-8") as f:
-            yield from _scan(f)
+        dialect = csv.Sniffer().sniff(first, delimiters=",;\t|")
+    except csv.Error:
+        dialect = csv.excel
+    reader = csv.reader(itertools.chain([first], lines), dialect)
+
+    selected: List[Tuple[int, str]] = []
+    if header:
+        header = next(reader, None) or []
+        for _ in range(reader.line_num):
+            consumed.popleft()
+        for c in columns:
+            if c.isdigit():
+                selected.append((int(c) - 1, header[int(c) - 1] if 0 < int(c) <= len(header) else c))
+            elif c in header:
+                selected.append((header.index(c), c))
+    else:
+        selected = [(int(c) - 1, c) for c in columns if c.isdigit()]
+    if not selected:
         return
-    except UnicodeDecodeError:
-        pass
+
+    row_no = 0
+    line_no = reader.line_num
+    for row in reader:
+        row_no += 1
+        record_lines = [consumed.popleft() for _ in range(reader.line_num - line_no)]
+        start_line = line_no + 1
+        line_no = reader.line_num
+        for idx, name in selected:
+            if idx < len(row) and needle in fold(row[idx]):
+                record = "".join(r[0] for r in record_lines).rstrip("\r\n")
+                start = _csv_field_start(record, idx, dialect)
+                col = fold(record).find(needle, start)
+                if col < 0:
+                    col = start
+                snippet, clipped = _clip(record, col, len(needle))
+                # quoted fields may span lines; keep the snippet on one line
+                snippet = snippet.replace("\r", " ").replace("\n", " ")
+                _, offset, enc, errors = record_lines[0]
+                offset += _byte_len(record[:col], enc, errors)
+                yield start_line, col + 1, offset, snippet, clipped, f"/{row_no}/{_pointer_escape(name)}"
+                break
+    return detected[0]
+
+def _csv_field_start(record: str, index: int, dialect) -> int:
+    """
+    Character position where field number 'index' (0-based) starts in a raw CSV record.
+    """
+    field = 0
+    quoted = False
+    for i, ch in enumerate(record):
+        if field == index:
+            return i
+        if ch == dialect.quotechar:
+            quoted = not quoted
+        elif ch == dialect.delimiter and not quoted:
+            field += 1
+    return len(record)
+
+# ---- JSON ----
+
+def parse_json_path(path: str) -> List[str]:
+    """
+    Split a key path into segments. Accepts dotted ('items.*.name', '$.items.*.name')
+    and JSON pointer ('/items/*/name') forms; '*' matches one level, '**' any depth.
+    """
+    path = path.strip()
+    if path.startswith("/"):
+        return [p.replace("~1", "/").replace("~0", "~") for p in path[1:].split("/")]
+    if path.startswith("$"):
+        path = path[1:].lstrip(".")
+    return [p for p in path.split(".") if p]
+
+def _path_match(parts: List[str], pattern: List[str], prefix: bool) -> bool:
+    """
+    True if 'parts' matches 'pattern'; with prefix=True, if some descendant of 'parts' could.
+    """
+    if not parts:
+        return prefix or all(p == "**" for p in pattern)
+    if not pattern:
+        return False
+    if pattern[0] == "**":
+        return _path_match(parts, pattern[1:], prefix) or _path_match(parts[1:], pattern, prefix)
+    if fnmatch.fnmatchcase(parts[0], pattern[0]):
+        return _path_match(parts[1:], pattern[1:], prefix)
+    return False
+
+def _json_path_regex(pattern: List[str]) -> str:
+    """
+    Translate path segments into a regex over paths written as '\0key\0key...'.
+    """
+    out = []
+    for seg in pattern:
+        if seg == "**":
+            out.append("(?:\0[^\0]*)*")
+        else:
+            out.append("\0" + "".join("[^\0]*" if ch == "*" else "[^\0]" if ch == "?" else re.escape(ch) for ch in seg))
+    return "".join(out)
+
+def _pointer_escape(key: str) -> str:
+    return key.replace("~", "~0").replace("/", "~1")
+
+_JSON_STOP = re.compile(r'["{}\[\],:]|[^\s"{}\[\],:]+')
+_JSON_SKIP = re.compile(r'["{}\[\]]')
+_JSON_DECODER = json.JSONDecoder()
+
+class _JsonScanner:
+    """
+    Streaming JSON (and JSON Lines) scanner.
+
+    Tokens are read from a sliding text buffer that only ever holds the current
+    block plus an unfinished token. Containers and strings outside the selected
+    key paths are skipped with bracket/quote hopping, without building values.
+    A scalar is selected when its path, or one of its ancestors' paths, matches a pattern.
+    """
+    def __init__(self, raw, search_string: str, case_sensitive: bool, patterns: List[List[str]],
+                 block_size: int=DEFAULT_BLOCK_SIZE, encoding: Optional[str]=None):
+        self.blocks = _iter_text_blocks(raw, block_size, encoding)
+        self.needle, self.fold = _matcher(search_string, case_sensitive)
+        self.patterns = [p + ["**"] for p in patterns] or [["**"]]
+        self.path_rx = re.compile("|".join(_json_path_regex(p) for p in self.patterns))
+        # numbers are compared as written in the file, which a decoded float may not reproduce
+        self.numeric_needle = bool(self.needle) and all(ch in "0123456789.eE+-" for ch in self.needle)
+        self.buf = ""
+        self.pos = 0
+        self.eof = False
+        self.enc, self.errors = _ENCODINGS[_encoding_index(encoding)]
+        # location of buf[0], and a cursor that only moves forward inside buf
+        self.buf_line, self.buf_col, self.buf_byte = 1, 0, 0
+        self.cur_pos, self.cur_line, self.cur_byte = 0, 1, 0
+
+    # -- buffer management --
+
+    def _fill(self) -> bool:
+        """
+        Drop consumed text and append the next block; False at end of input.
+        """
+        if self.eof:
+            return False
+        self._trim(self.pos)
+        block = next(self.blocks, None)
+        if block is None:
+            self.eof = True
+            return False
+        text, self.enc, self.errors = block
+        self.buf += text
+        return True
+
+    def _trim(self, k: int):
+        self._advance(k)
+        nl = self.buf.rfind("\n", 0, k)
+        self.buf_col = k - (nl + 1) if nl >= 0 else self.buf_col + k
+        self.buf_line, self.buf_byte = self.cur_line, self.cur_byte
+        self.buf = self.buf[k:]
+        self.pos -= k
+        self.cur_pos = 0
+
+    def _advance(self, p: int):
+        if p > self.cur_pos:
+            self.cur_line += self.buf.count("\n", self.cur_pos, p)
+            self.cur_byte += _byte_len(self.buf[self.cur_pos:p], self.enc, self.errors)
+            self.cur_pos = p
+
+    def _locate(self, p: int) -> Tuple[int, int, int]:
+        """
+        (line, 1-based column, byte offset) of buf[p].
+        """
+        self._advance(p)
+        nl = self.buf.rfind("\n", 0, p)
+        col = p - (nl + 1) if nl >= 0 else self.buf_col + p
+        return self.cur_line, col + 1, self.cur_byte
+
+    # -- lexing --
+
+    def _string_end(self, start: int, scan: int) -> int:
+        """
+        Index of the closing quote of the string whose body starts at 'start', or -1.
+        The search for quotes begins at 'scan'.
+        """
+        i = scan
+        while True:
+            q = self.buf.find('"', i)
+            if q < 0:
+                return -1
+            j = q - 1
+            while j >= start and self.buf[j] == "\\":
+                j -= 1
+            if (q - 1 - j) % 2 == 0:
+                return q
+            i = q + 1
+
+    def _read_string(self, keep: bool) -> Optional[str]:
+        """
+        Consume a string whose opening quote was just read. Returns the raw body when
+        'keep' is set and the body fits MAX_JSON_VALUE_CHARS, else None.
+        """
+        start = scan = self.pos
+        while True:
+            end = self._string_end(start, scan)
+            if end >= 0:
+                self.pos = end + 1
+                return self.buf[start:end] if keep else None
+            if keep and len(self.buf) - start > MAX_JSON_VALUE_CHARS:
+                keep = False
+            # a trailing run of backslashes decides whether the next quote is escaped
+            scan = len(self.buf)
+            while scan > start and self.buf[scan - 1] == "\\":
+                scan -= 1
+            self.pos = start if keep else scan
+            shift = self.pos
+            if not self._fill():
+                self.pos = len(self.buf)
+                return None
+            start, scan = 0, scan - shift
+
+    def hits(self) -> Generator[Hit, None, str]:
+        """
+        Yield the hits; returns the encoding the input was decoded with.
+        """
+        stack: List[list] = []  # frames: [is_object, key_or_index, awaiting_key]
+        while True:
+            m = _JSON_STOP.search(self.buf, self.pos)
+            if m is None or (m.end() == len(self.buf) and m.group()[0] not in '"{}[],:'):
+                # out of text, or a number/literal that may continue in the next block
+                if self._fill():
+                    continue
+                m = _JSON_STOP.search(self.buf, self.pos)
+                if m is None:
+                    return self.enc
+            tok = m.group()
+            self.pos = m.end()
+            ch = tok[0]
+
+            if ch == "{" or ch == "[":
+                path = [f[1] for f in stack]
+                if not any(_path_match(path, p, True) for p in self.patterns):
+                    self._skip_container(m.start())
+                elif not self._skip_unmatched(m.start(), path):
+                    stack.append([ch == "{", None if ch == "{" else "0", ch == "{"])
+                    continue
+                self._value_done(stack)
+            elif ch == "}" or ch == "]":
+                if stack:
+                    stack.pop()
+                self._value_done(stack)
+            elif ch == ",":
+                if stack:
+                    top = stack[-1]
+                    if top[0]:
+                        top[2] = True
+                    else:
+                        top[1] = str(int(top[1]) + 1)
+            elif ch == ":":
+                pass
+            elif ch == '"':
+                if stack and stack[-1][0] and stack[-1][2]:
+                    body = self._read_string(True)
+                    stack[-1][1] = _json_unescape(body) if body is not None else ""
+                    stack[-1][2] = False
+                    continue
+                start = self.pos - 1
+                path = [f[1] for f in stack]
+                if not self._selected(path):
+                    self._read_string(False)
+                    self._value_done(stack)
+                    continue
+                line, col, offset = self._locate(start)
+                body = self._read_string(True)
+                if body is not None:
+                    value = _json_unescape(body)
+                    hit = self._check(value, line, col, offset, path)
+                    if hit is not None:
+                        yield hit
+                self._value_done(stack)
+            else:
+                path = [f[1] for f in stack]
+                if self._selected(path):
+                    line, col, offset = self._locate(m.start())
+                    hit = self._check(tok, line, col, offset, path)
+                    if hit is not None:
+                        yield hit
+                self._value_done(stack)
+
+    def _selected(self, path: List[str]) -> bool:
+        return self.path_rx.fullmatch("".join("\0" + k for k in path)) is not None
+
+    @staticmethod
+    def _value_done(stack: List[list]):
+        if stack and stack[-1][0]:
+            stack[-1][2] = False
+
+    def _check(self, value: str, line: int, col: int, offset: int, path: List[str]) -> Optional[Hit]:
+        p = self.fold(value).find(self.needle)
+        if p < 0:
+            return None
+        snippet, clipped = _clip(value, p, len(self.needle))
+        pointer = "".join("/" + _pointer_escape(k) for k in path)
+        return line, col, offset, snippet, clipped, pointer
+
+    def _decode_value(self, start: int) -> Optional[Tuple[object, int]]:
+        """
+        Let the C decoder parse the value starting at buf[start]; returns (value, end) or
+        None if it does not fit the buffer plus one more block (or is not valid JSON).
+        The position is left just after the value's first character.
+        """
+        for attempt in range(2):
+            try:
+                return _JSON_DECODER.raw_decode(self.buf, start)
+            except ValueError:
+                # probably cut off at the end of the buffer: give it one more block
+                if attempt or self.eof:
+                    return None
+                self.pos = start
+                filled = self._fill()
+                # the buffer now starts at the value
+                start, self.pos = 0, 1
+                if not filled:
+                    return None
+        return None
+
+    def _skip_unmatched(self, start: int, path: List[str]) -> bool:
+        """
+        Fast path for a selected container starting at buf[start]: let the C decoder
+        parse it and skip it outright when none of its selected values can match.
+        Only containers that may hold a hit are tokenized for exact positions.
+        Returns True if the container was skipped.
+        """
+        decoded = self._decode_value(start)
+        if decoded is None:
+            return False
+        value, end = decoded
+        raw = self.buf[self.pos - 1:end]
+        if self.needle in self.fold(raw) or "\\" in raw:
+            try:
+                if self._may_match(value, "".join("\0" + k for k in path)):
+                    return False
+            except RecursionError:
+                return False
+        self.pos = end
+        return True
+
+    def _may_match(self, value, path: str) -> bool:
+        """
+        True if a selected scalar inside the decoded 'value' (at NUL-joined 'path') could match.
+        """
+        if isinstance(value, dict):
+            return any(self._may_match(v, path + "\0" + k) for k, v in value.items())
+        if isinstance(value, list):
+            return any(self._may_match(v, path + "\0" + str(i)) for i, v in enumerate(value))
+        if self.path_rx.fullmatch(path) is None:
+            return False
+        if isinstance(value, str):
+            return self.needle in self.fold(value)
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            return self.numeric_needle
+        return self.needle in json.dumps(value)
+
+    def _skip_container(self, start: int):
+        """
+        Skip the container starting at buf[start] (its bracket was just read): through the
+        C decoder when it fits the buffer, else by hopping between quotes and brackets.
+        """
+        decoded = self._decode_value(start)
+        if decoded is not None:
+            self.pos = decoded[1]
+            return
+        depth = 1
+        while depth:
+            m = _JSON_SKIP.search(self.buf, self.pos)
+            if m is None:
+                self.pos = len(self.buf)
+                if not self._fill():
+                    return
+                continue
+            self.pos = m.end()
+            ch = m.group()
+            if ch == '"':
+                self._read_string(False)
+            elif ch in "{[":
+                depth += 1
+            else:
+                depth -= 1
+
+def _json_unescape(body: str) -> str:
+    if "\\" not in body:
+        return body
+    try:
+        return json.loads('"' + body + '"')
+    except ValueError:
+        return body
+
+class _CancellableReader:
+    """
+    Binary reader that reports end of file once 'cancel' is set.
+    """
+    def __init__(self, raw, cancel: threading.Event):
+        self.raw = raw
+        self.cancel = cancel
+
+    def read(self, size: int=-1) -> bytes:
+        if self.cancel.is_set():
+            return b""
+        return self.raw.read(size)
+
+    def seek(self, offset: int, whence: int=os.SEEK_SET) -> int:
+        return self.raw.seek(offset, whence)
+
+    def tell(self) -> int:
+        return self.raw.tell()
+
+def _iter_plain_hits(raw, search_string: str, case_sensitive: bool, options: ScanOptions,
+                     encoding: Optional[str], from_start: bool=True) -> Generator[Hit, None, str]:
+    if options.multiline or options.regex:
+        pattern = compile_pattern(search_string, case_sensitive, options.regex)
+        return iter_multiline_hits(raw, pattern, options.block_size, encoding, first_line=1 if from_start else None)
+    return iter_hits(raw, search_string, case_sensitive, options.block_size, encoding)
+
+class _ProgressReader:
+    """
+    Binary reader starting at byte 'start', the beginning of line 'line', that keeps
+    progress[:] = [offset, line number] at the latest line start lying at least 'lag'
+    bytes behind everything read so far. iter_hits has finished every line before
+    such a point whenever it asks for more data, so the scan can resume from there.
+    """
+    def __init__(self, raw, start: int, line: int, lag: int, progress: List[int]):
+        raw.seek(start)
+        self.raw = raw
+        self.pos = start
+        self.line = line
+        self.lag = lag
+        self.progress = progress
+        self.recent: "collections.deque[Tuple[int, int, bytes]]" = collections.deque(maxlen=3)
+
+    def read(self, size: int=-1) -> bytes:
+        self._advance(self.pos - self.lag)
+        data = self.raw.read(size)
+        if data:
+            self.recent.append((self.pos, self.line, data))
+            self.pos += len(data)
+            self.line += data.count(b"\n")
+        return data
+
+    def _advance(self, target: int):
+        if target <= self.progress[0]:
+            return
+        for offset, line, data in reversed(self.recent):
+            if offset >= target:
+                continue
+            nl = data.rfind(b"\n", 0, target - offset)
+            if nl >= 0:
+                if offset + nl + 1 > self.progress[0]:
+                    # one slice assignment, so readers in other threads never see a torn pair
+                    self.progress[:] = [offset + nl + 1, line + data.count(b"\n", 0, nl + 1)]
+                return
+
+def _iter_resumable_hits(raw, search_string: str, case_sensitive: bool, options: ScanOptions,
+                         encoding: Optional[str], progress: List[int]) -> Generator[Hit, None, Optional[str]]:
+    start, line = progress
+    # bytes the block scanner may hold back undecided: its lookahead in worst-case utf-8 plus a partial character
+    lag = 4 * max(MAX_LINE_CHARS, len(search_string) + SNIPPET_CONTEXT) + 4
+    hits = iter_hits(_ProgressReader(raw, start, line, lag, progress), search_string, case_sensitive,
+                     options.block_size, encoding)
+    if not start:
+        return (yield from hits)
+    for hit in hits:
+        yield (hit[0] + line - 1, hit[1], hit[2] + start) + hit[3:]
+    # the rest of a file says little about the encoding of the whole
+    return None
+
+def iter_file_hits(file_path: str, search_string: str, case_sensitive: bool=False,
+                   options: Optional[ScanOptions]=None,
+                   progress: Optional[List[int]]=None) -> Generator[Hit, None, None]:
+    """
+    Yield the hits of one file, using the CSV/JSON scanners when 'options' selects
+    columns/key paths for the file's type and the plain block scanner otherwise.
+    With options.time_window, plain-text files are only read inside the window
+    (and skipped when it is empty); hits after the first byte get line number 0.
+    'progress' ([byte offset, line number] of a line start) makes a plain line scan
+    start there and keeps it at a point up to which all hits have been yielded
+    (other scans leave it alone and always start from the top).
+    """
+    options = options or ScanOptions()
+    ext = os.path.splitext(file_path)[1].lower()
+    cache = options.encoding_cache
+    encoding = cache.get(file_path) if cache is not None else None
+    with _open_binary(file_path) as f:
+        raw = _CancellableReader(f, options.cancel) if options.cancel is not None else f
+        if options.csv_columns and ext in _CSV_EXTENSIONS:
+            encoding = yield from _iter_csv_hits(raw, search_string, case_sensitive, options.csv_columns,
+                                                 options.block_size, encoding, options.csv_header)
+        elif options.json_paths and ext in _JSON_EXTENSIONS:
+            encoding = yield from _JsonScanner(raw, search_string, case_sensitive, options.json_paths,
+                                               options.block_size, encoding).hits()
+        elif options.time_window is not None:
+            span = options.time_window.locate(f, f.seek(0, os.SEEK_END))
+            if span is None:
+                return
+            raw = _SliceReader(raw, *span)
+            hits = _iter_plain_hits(raw, search_string, case_sensitive, options, encoding, span[0] == 0)
+            encoding = yield from (_rebase_hits(hits, span[0]) if span[0] else hits)
+            if span[0]:
+                # the slice says little about the encoding of the whole file
+                encoding = None
+        elif progress is not None and not (options.multiline or options.regex):
+            encoding = yield from _iter_resumable_hits(raw, search_string, case_sensitive, options, encoding, progress)
+        else:
+            encoding = yield from _iter_plain_hits(raw, search_string, case_sensitive, options, encoding)
+    if cache is not None and encoding and not (options.cancel is not None and options.cancel.is_set()):
+        cache[file_path] = encoding
+
+# ------------------ Per-device scheduling ------------------
+
+def file_device(file_path: str) -> int:
+    """
+    Return the st_dev of file_path (-1 if it cannot be stat'ed).
+    """
+    try:
+        return os.stat(file_path).st_dev
+    except OSError:
+        return -1
+
+def group_by_device(files: Iterable[str]) -> Dict[int, List[str]]:
+    """
+    Group files by the device they live on, keeping discovery order within each group.
+    """
+    groups: Dict[int, List[str]] = {}
+    for p in files:
+        groups.setdefault(file_device(p), []).append(p)
+    return groups
+
+def _device_is_rotational(dev: int) -> Optional[bool]:
+    """
+    True for spinning disks, False for SSDs and non-block (NFS, tmpfs, ...) devices,
+    None when it cannot be determined (non-Linux, unknown device).
+    """
+    if dev < 0 or not hasattr(os, "major"):
+        return None
+    major, minor = os.major(dev), os.minor(dev)
+    if major == 0:
+        # anonymous device numbers are used by NFS/SMB/tmpfs/overlay mounts
+        return False
+    base = f"/sys/dev/block/{major}:{minor}"
+    # partitions keep the queue attributes on their parent disk
+    for cand in (os.path.join(base, "queue", "rotational"),
+                 os.path.join(base, "..", "queue", "rotational")):
+        try:
+            with open(cand, "r") as f:
+                return f.read().strip() == "1"
+        except OSError:
+            continue
+    return None
+
+def device_parallelism(dev: int, workers: int=DEFAULT_WORKERS) -> int:
+    """
+    Number of files that may be read concurrently from device 'dev':
+    spinning disks are read sequentially, everything else gets 'workers' readers.
+    """
+    if workers <= 1 or _device_is_rotational(dev):
+        return 1
+    return workers
+
+# Batch = (file_path, hits, last, error): part of the hits of one file, see _scan_batches
+Batch = Tuple[str, List[Hit], bool, Optional[Exception]]
+
+def _scan_batches(file_path: str, search_string: str, case_sensitive: bool,
+                  options: Optional[ScanOptions]=None) -> Generator[Batch, None, None]:
+    """
+    Yield the hits of one file (at most options.max_hits) as (file_path, hits, last, error)
+    batches of at most SCAN_BATCH_HITS hits. A smaller batch is handed on once
+    SCAN_BATCH_SECONDS have passed since the previous one, so sparse matches are not held
+    back. The last batch (possibly empty) has 'last' set and carries the error that ended
+    the scan, if any; hits found before an error are kept.
+    With options.checkpoint the scan continues where an earlier run stopped and the
+    hits known from it come first.
+    """
+    progress, known = None, None
+    if options is not None and options.checkpoint is not None:
+        progress, known = options.checkpoint.start_file(file_path)
+    limit = options.max_hits if options is not None else None
+    batch = list(known) if known else []
+    count = len(batch)
+    error = None
+    handed_on = float("-inf")
+    hits = iter_file_hits(file_path, search_string, case_sensitive, options, progress)
+    try:
+        for hit in hits:
+            if known is not None:
+                # the checkpoint saves the hits of the running file from this list
+                known.append(hit)
+            batch.append(hit)
+            count += 1
+            if limit is not None and count >= limit:
+                break
+            now = time.monotonic()
+            if len(batch) >= SCAN_BATCH_HITS or now - handed_on >= SCAN_BATCH_SECONDS:
+                yield file_path, batch, False, None
+                batch, handed_on = [], now
     except Exception as e:
-        # Re-raise to let caller handle
-        raise
+        error = e
+    finally:
+        hits.close()
+    yield file_path, batch, True, error
+
+def _put_result(results: "queue.Queue", item, stop: threading.Event) -> bool:
+    # a full queue waits for the caller, who may abandon the scan meanwhile
+    while not stop.is_set():
+        try:
+            results.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+def _device_worker(pending: "queue.Queue[str]", results: "queue.Queue", stop: threading.Event,
+                   job: Callable[[str], Iterable[tuple]]):
+    try:
+        while not stop.is_set():
+            try:
+                file_path = pending.get_nowait()
+            except queue.Empty:
+                return
+            # the file the next free reader of this device will take
+            with pending.mutex:
+                upcoming = pending.queue[0] if pending.queue else None
+            if upcoming is not None:
+                _io_limits.prefetch(upcoming)
+            items = job(file_path)
+            try:
+                for item in items:
+                    if not _put_result(results, item, stop):
+                        return
+            finally:
+                if hasattr(items, "close"):
+                    items.close()
+    finally:
+        # tells _run_per_device that this reader is done
+        _put_result(results, None, stop)
+
+def _run_per_device(files: List[str], job: Callable[[str], Iterable[tuple]],
+                    workers: int=DEFAULT_WORKERS) -> Generator[tuple, None, None]:
+    """
+    Run job(file_path) for every file, with one pool of readers per device
+    (see device_parallelism), and yield the results it produces in arrival order.
+    At most _RESULT_QUEUE_BATCHES results wait for the caller; readers block until
+    it takes them.
+    """
+    results: "queue.Queue" = queue.Queue(_RESULT_QUEUE_BATCHES)
+    stop = threading.Event()
+    readers = 0
+    for dev, paths in group_by_device(files).items():
+        pending: "queue.Queue[str]" = queue.Queue()
+        for p in paths:
+            pending.put(p)
+        for _ in range(min(device_parallelism(dev, workers), len(paths))):
+            threading.Thread(target=_device_worker, args=(pending, results, stop, job), daemon=True).start()
+            readers += 1
+    try:
+        while readers:
+            item = results.get()
+            if item is None:
+                readers -= 1
+            else:
+                yield item
+    finally:
+        # stops the readers early if the caller abandons the generator
+        stop.set()
+
+class _SpillFile:
+    """
+    Anonymous temp file holding pickled objects until they are read back.
+    """
+    def __init__(self):
+        self._file = None
+
+    def dump(self, obj) -> Tuple[int, int]:
+        if self._file is None:
+            self._file = tempfile.TemporaryFile(prefix="text-searcher-")
+        self._file.seek(0, os.SEEK_END)
+        pos = self._file.tell()
+        data = pickle.dumps(obj, pickle.HIGHEST_PROTOCOL)
+        self._file.write(data)
+        return pos, len(data)
+
+    def load(self, ref: Tuple[int, int]):
+        pos, size = ref
+        self._file.seek(pos)
+        return pickle.loads(self._file.read(size))
 
-    # encodings fallbacks
-    for enc in ("gbk", "latin-1"):
+    def reset(self):
+        """
+        Drop everything dumped so far.
+        """
+        if self._file is not None:
+            self._file.truncate(0)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+class _ReorderBuffer:
+    """
+    Turns the interleaved batches of files scanned in parallel into one stream in
+    which the batches of every file follow each other.
+
+    The file whose turn it is streams straight through; batches of other files are
+    held until their turn comes. With 'ordered' the turn follows the discovery index,
+    otherwise files that have already finished go first, then the others in the order
+    their first batch arrived. At most 'max_lines' held match lines are kept in memory;
+    further batches are pickled into an anonymous temp file and read back when their
+    turn comes.
+    """
+    def __init__(self, max_lines: int, ordered: bool=True):
+        self.max_lines = max_lines
+        self.ordered = ordered
+        self.current: Optional[int] = 0 if ordered else None
+        self.pending: Dict[int, List[tuple]] = {}
+        self.finished: collections.deque = collections.deque()
+        self.held = 0
+        self.spilled = 0
+        self._spill = _SpillFile()
+
+    def push(self, index: int, batch: Batch) -> Generator[Batch, None, None]:
+        """
+        Add a batch of file number 'index'; yield every batch now ready, in order.
+        """
+        if self.current is None:
+            self.current = index
+        if index == self.current:
+            yield batch
+            if batch[2]:
+                yield from self._advance()
+            return
+        file_path, hits, last, error = batch
+        if self.held + len(hits) > self.max_lines:
+            self.pending.setdefault(index, []).append((file_path, self._spill.dump(hits), last, error, True))
+            self.spilled += 1
+        else:
+            self.held += len(hits)
+            self.pending.setdefault(index, []).append((file_path, hits, last, error, False))
+        if last and not self.ordered:
+            self.finished.append(index)
+
+    def _advance(self) -> Generator[Batch, None, None]:
+        while True:
+            if self.ordered:
+                self.current += 1
+            elif self.finished:
+                self.current = self.finished.popleft()
+            elif self.pending:
+                self.current = next(iter(self.pending))
+            else:
+                self.current = None
+                return
+            held = self.pending.pop(self.current, None)
+            if held is None:
+                return
+            for file_path, hits, last, error, spilled in held:
+                if spilled:
+                    hits = self._spill.load(hits)
+                    self.spilled -= 1
+                    if not self.spilled:
+                        self._spill.reset()
+                else:
+                    self.held -= len(hits)
+                yield file_path, hits, last, error
+            if not last:
+                # the rest of this file streams through as it arrives
+                return
+
+    def close(self):
+        self._spill.close()
+
+def scan_files(files: List[str], search_string: str, case_sensitive: bool=False,
+               workers: int=DEFAULT_WORKERS, ordered: bool=False,
+               reorder_limit: int=DEFAULT_REORDER_LINES,
+               options: Optional[ScanOptions]=None,
+               duplicates: Optional[Dict[str, List[str]]]=None) -> Generator[Batch, None, None]:
+    """
+    Scan 'files' and yield their hits as (file_path, hits, last, error) batches while
+    they are found (see _scan_batches). The batches of one file follow each other and
+    its last one has 'last' set, carrying the error that ended the scan, if any.
+    Files come in completion order, except that a file streaming its hits keeps
+    its turn until it is done.
+
+    Files are grouped by st_dev and every device gets its own pool of readers
+    (see device_parallelism), so a slow mount never holds back a fast one.
+    With workers <= 1 files are scanned sequentially in the calling thread.
+
+    If 'ordered' is True files come in the order of 'files' instead. Only the hits of
+    files whose turn has not come yet wait in a reorder buffer holding at most
+    'reorder_limit' match lines in memory, the rest is spilled to a temp file.
+
+    'options' (ScanOptions) selects CSV columns / JSON key paths and the block size.
+
+    'duplicates' ({path: [paths with the same content]}, see find_duplicates) scans each
+    content once; the copies get the same hits right after the file that was scanned.
+    """
+    if duplicates:
+        copies = {p for same in duplicates.values() for p in same}
+        results = scan_files([p for p in files if p not in copies], search_string, case_sensitive,
+                             workers, ordered, reorder_limit, options)
+        # the batches of a file with copies, replayed for each copy once the file is done
+        spill, kept = _SpillFile(), []
+        try:
+            for batch in results:
+                yield batch
+                file_path, hits, last, error = batch
+                same = duplicates.get(file_path)
+                if not same:
+                    continue
+                kept.append(spill.dump(hits))
+                if not last:
+                    continue
+                for p in same:
+                    for i, ref in enumerate(kept):
+                        final = i == len(kept) - 1
+                        yield p, spill.load(ref), final, error if final else None
+                spill.reset()
+                kept = []
+        finally:
+            results.close()
+            spill.close()
+        return
+
+    if workers <= 1 or len(files) <= 1:
+        for i, file_path in enumerate(files):
+            if i + 1 < len(files):
+                _io_limits.prefetch(files[i + 1])
+            yield from _scan_batches(file_path, search_string, case_sensitive, options)
+        return
+
+    index = {p: i for i, p in enumerate(files)}
+    results = _run_per_device(files, lambda p: _scan_batches(p, search_string, case_sensitive, options), workers)
+    reorder = _ReorderBuffer(reorder_limit, ordered)
+    try:
+        for batch in results:
+            yield from reorder.push(index[batch[0]], batch)
+    finally:
+        results.close()
+        reorder.close()
+
+# ------------------ Checkpoints ------------------
+
+# Seconds between automatic checkpoint saves
+CHECKPOINT_INTERVAL = 10.0
+
+class Checkpoint:
+    """
+    Resumable state of one search, kept in two files:
+
+    'path' holds the search description, the paths of the files whose results have
+    been reported and, for files being scanned, a line start up to which every hit
+    is known (see _ProgressReader) together with those hits. It is gzip-compressed
+    JSON, written to a temp file that then replaces 'path', so a crash never leaves
+    a half-written checkpoint.
+
+    'path' + '.journal' receives the hits of every finished file once, as a gzip member
+    holding one JSON line, and is only appended to. The state records how much of it
+    is complete, so a crash in the middle of an append is cut off on resume. Hits of
+    finished files are not kept in memory and saves only encode the small state.
+
+    'search' describes the search; a saved state is only resumed if it was written for
+    the same description ('status' is 'resumed', 'new' or 'mismatch'). 'window' holds
+    the resolved [since, until] of a time window, so a resumed run searches the same
+    lines even when the window was given relative to the current time.
+    """
+    VERSION = 2
+
+    def __init__(self, path: str, search: Dict):
+        self.path = path
+        self.journal_path = path + ".journal"
+        # compare in JSON form (tuples become lists)
+        self.search = json.loads(json.dumps(search))
+        self.done: Set[str] = set()
+        self.partial: Dict[str, Tuple[int, int, List[Hit]]] = {}
+        self.running: Dict[str, Tuple[List[int], List[Hit]]] = {}
+        self.window: Optional[List[Optional[float]]] = None
+        self.lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._journal_size = 0
+        self.status = self._load()
+        if self.status == "resumed":
+            self._journal = open(self.journal_path, "r+b")
+            self._journal.truncate(self._journal_size)
+            self._journal.seek(self._journal_size)
+        else:
+            self.done, self.partial, self.window = set(), {}, None
+            self._journal = open(self.journal_path, "wb")
+
+    def _load(self) -> str:
+        try:
+            with gzip.open(self.path, "rt", encoding="utf-8") as f:
+                state = json.load(f)
+        except FileNotFoundError:
+            return "new"
+        except (OSError, ValueError, EOFError):
+            return "mismatch"
+        if state.get("version") != self.VERSION or state.get("search") != self.search:
+            return "mismatch"
         try:
-            with open(file_path, "r", encoding=enc, errors="ignore") as f:
-                yield from _scan(f)
+            if os.path.getsize(self.journal_path) < state["journal"]:
+                return "mismatch"
+        except OSError:
+            return "mismatch"
+        self._journal_size = state["journal"]
+        self.done = set(state["done"])
+        self.partial = {p: (offset, line, [tuple(h) for h in hits]) for p, offset, line, hits in state["partial"]}
+        self.window = state.get("window")
+        return "resumed"
+
+    def iter_done(self) -> Generator[Tuple[str, List[Hit]], None, None]:
+        """
+        (path, hits) of the files finished by earlier runs, in the order they finished.
+        """
+        if not self._journal_size:
             return
-        except Exception:
+        with gzip.open(self.journal_path, "rt", encoding="utf-8") as f:
+            for line in f:
+                file_path, hits = json.loads(line)
+                yield file_path, [tuple(h) for h in hits]
+
+    def start_file(self, file_path: str) -> Tuple[List[int], List[Hit]]:
+        """
+        Begin (or continue) scanning a file: returns the progress list to hand to
+        iter_file_hits and the hits already known, to be extended in place.
+        """
+        with self.lock:
+            offset, line, hits = self.partial.pop(file_path, (0, 1, []))
+            progress, hits = [offset, line], list(hits)
+            self.running[file_path] = (progress, hits)
+        return progress, hits
+
+    def complete(self, file_path: str, hits: List[Hit]):
+        """
+        Record that the results of a file have been reported, appending its hits to the journal.
+        """
+        # level 1: the journal is written once per file and mostly holds similar lines
+        data = gzip.compress((json.dumps([file_path, hits], separators=(",", ":")) + "\n").encode("utf-8"), 1)
+        with self.lock:
+            self.running.pop(file_path, None)
+            self.partial.pop(file_path, None)
+            self.done.add(file_path)
+            self._journal.write(data)
+
+    def save(self):
+        # copy what changes under the lock; encoding and writing happen outside it
+        with self.lock:
+            self._journal.flush()
+            journal_size = self._journal.tell()
+            done = list(self.done)
+            partial = [[p, offset, line, hits] for p, (offset, line, hits) in self.partial.items()]
+            running = [(p, tuple(progress), list(hits)) for p, (progress, hits) in self.running.items()]
+        os.fsync(self._journal.fileno())
+        for p, (offset, line), hits in running:
+            partial.append([p, offset, line, [h for h in hits if h[2] < offset]])
+        state = {"version": self.VERSION, "search": self.search, "done": done, "partial": partial,
+                 "window": self.window, "journal": journal_size}
+        data = gzip.compress(json.dumps(state, separators=(",", ":")).encode("utf-8"))
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp = tempfile.mkstemp(dir=directory, prefix=os.path.basename(self.path) + ".", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, self.path)
+        except BaseException:
+            with contextlib.suppress(OSError):
+                os.remove(tmp)
+            raise
+
+    def _autosave(self, interval: float):
+        while not self._stop.wait(interval):
+            try:
+                self.save()
+            except OSError as e:
+                print(f"⚠️ 无法保存检查点 '{self.path}'：{e}")
+
+    def start_autosave(self, interval: float=CHECKPOINT_INTERVAL):
+        self._thread = threading.Thread(target=self._autosave, args=(interval,), daemon=True)
+        self._thread.start()
+
+    def close(self, finished: bool):
+        """
+        Stop saving periodically; a finished search removes the checkpoint and its journal,
+        otherwise the state is saved.
+        """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        try:
+            if not finished:
+                self.save()
+        finally:
+            self._journal.close()
+        if finished:
+            for p in (self.path, self.journal_path):
+                with contextlib.suppress(FileNotFoundError):
+                    os.remove(p)
+
+# ------------------ Query refinement ------------------
+
+def is_refinement(previous: str, search_string: str, case_sensitive: bool=False) -> bool:
+    """
+    True if every line matching 'search_string' also matched 'previous', i.e. the new
+    term contains the old one (compared case-insensitively unless case_sensitive).
+    """
+    if not previous:
+        return False
+    if case_sensitive:
+        return previous in search_string
+    return previous.lower() in search_string.lower()
+
+def _refine_in_memory(hits: List[Hit], search_string: str, case_sensitive: bool) -> Optional[List[Hit]]:
+    """
+    Re-check whole-line plain-text hits of a utf-8 file against a narrower term.
+    Returns None when a hit cannot be decided from its snippet (clipped, CSV/JSON field).
+    """
+    needle, fold = _matcher(search_string, case_sensitive)
+    refined = []
+    for line_no, column, offset, snippet, clipped, field in hits:
+        if clipped or field:
+            return None
+        hay = fold(snippet)
+        if len(hay) != len(snippet):
+            return None
+        p = hay.find(needle)
+        if p < 0:
             continue
+        old = snippet[:column - 1]
+        offset += len(snippet[:p].encode("utf-8")) - len(old.encode("utf-8"))
+        refined.append((line_no, p + 1, offset, snippet, False, ""))
+    return refined
+
+def refine_scan(previous: Iterable[Tuple[str, List[Hit]]], search_string: str, case_sensitive: bool=False,
+                workers: int=DEFAULT_WORKERS,
+                options: Optional[ScanOptions]=None) -> Generator[Batch, None, None]:
+    """
+    Narrow the (file_path, hits) results of an earlier search to 'search_string'
+    (see is_refinement) and yield (file_path, hits, last, error) batches like scan_files.
+
+    Only files that matched before are looked at. Files whose hits are whole lines and
+    whose encoding is known to be utf-8 (options.encoding_cache) are re-checked in memory;
+    the others are rescanned.
+    """
+    cache = options.encoding_cache if options is not None else None
+    rescan = []
+    for file_path, hits in previous:
+        refined = None
+        if cache is not None and cache.get(file_path) == "utf-8":
+            refined = _refine_in_memory(hits, search_string, case_sensitive)
+        if refined is None:
+            rescan.append(file_path)
+        else:
+            yield file_path, refined, True, None
+    if rescan:
+        yield from scan_files(rescan, search_string, case_sensitive, workers=workers, options=options)
+
+# ------------------ Heavy hitters ------------------
+
+# Templates reported by --aggregate, and counters kept per reported template
+DEFAULT_AGGREGATE_TOP = 20
+_AGGREGATE_SLOTS = 50
+# Example locations remembered per template
+AGGREGATE_EXAMPLES = 3
+
+# Variable parts of a log line, masked in this order (see normalize_line)
+_LINE_MASKS = (
+    (re.compile(r"\d{4}[-/]\d{2}[-/]\d{2}(?:[T ]\d{2}:\d{2}:\d{2}(?:[.,]\d+)?(?:Z|[+-]\d{2}:?\d{2})?)?"
+                r"|\d{2}/[A-Za-z]{3}/\d{4}:\d{2}:\d{2}:\d{2}(?: [+-]\d{4})?"
+                r"|\b\d{2}:\d{2}:\d{2}(?:[.,]\d+)?"), "<TS>"),
+    (re.compile(r"\b[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}\b"), "<UUID>"),
+    (re.compile(r"\b0[xX][0-9a-fA-F]+\b|\b(?=[0-9a-fA-F]*\d)[0-9a-fA-F]{16,}\b"), "<HEX>"),
+    (re.compile(r"\d+"), "<N>"),
+    (re.compile(r"\s+"), " "),
+)
+
+def normalize_line(text: str) -> str:
+    """
+    Reduce a matching line to its template: timestamps, UUIDs, hex ids and numbers
+    are masked ('<TS>', '<UUID>', '<HEX>', '<N>') and blanks collapsed, so lines that
+    differ only in such values count as the same message.
+    """
+    for pattern, mask in _LINE_MASKS:
+        text = pattern.sub(mask, text)
+    return text.strip()
+
+# Where a line was seen: (file_path, line number or 0, byte offset)
+Location = Tuple[str, int, int]
+
+class HeavyHitters:
+    """
+    Space-Saving summary of the most frequent templates in a stream, in bounded memory.
+
+    At most 'capacity' templates are counted. A template not yet counted when the table
+    is full takes over the slot of the least frequent one and inherits its count, which
+    is remembered as the error bound; a reported count is therefore never too low and
+    at most 'error' too high. Counters are grouped by count so every update is O(1).
+    Safe to feed from several threads.
+    """
+    def __init__(self, capacity: int=DEFAULT_AGGREGATE_TOP * _AGGREGATE_SLOTS, examples: int=AGGREGATE_EXAMPLES):
+        self.capacity = max(1, capacity)
+        self.examples = examples
+        self.total = 0
+        self.counts: Dict[str, int] = {}
+        self.errors: Dict[str, int] = {}
+        self.locations: Dict[str, List[Location]] = {}
+        self.buckets: Dict[int, set] = {}
+        self.min_count = 0
+        self.lock = threading.Lock()
+
+    def add(self, template: str, location: Location, times: int=1):
+        with self.lock:
+            for _ in range(times):
+                self._add(template, location)
+
+    def _add(self, template: str, location: Location):
+        self.total += 1
+        count = self.counts.get(template)
+        if count is not None:
+            self._unbucket(template, count)
+        elif len(self.counts) < self.capacity:
+            count = 0
+            self.errors[template] = 0
+            self.locations[template] = []
+        else:
+            # evict a least frequent template; the newcomer inherits its count
+            victim = next(iter(self.buckets[self.min_count]))
+            count = self.counts.pop(victim)
+            self._unbucket(victim, count)
+            del self.errors[victim], self.locations[victim]
+            self.errors[template] = count
+            self.locations[template] = []
+        self.counts[template] = count + 1
+        self.buckets.setdefault(count + 1, set()).add(template)
+        if count == 0:
+            self.min_count = 1
+        elif count == self.min_count and count not in self.buckets:
+            self.min_count = count + 1
+        seen = self.locations[template]
+        if len(seen) < self.examples:
+            seen.append(location)
+
+    def _unbucket(self, template: str, count: int):
+        bucket = self.buckets[count]
+        bucket.discard(template)
+        if not bucket:
+            del self.buckets[count]
+
+    def top(self, k: int=DEFAULT_AGGREGATE_TOP) -> List[Tuple[str, int, int, List[Location]]]:
+        """
+        The k most frequent templates as (template, count, error, example locations),
+        most frequent first; the true count lies within [count - error, count].
+        """
+        with self.lock:
+            ranked = sorted(self.counts.items(), key=lambda item: (-item[1], item[0]))[:k]
+            return [(t, c, self.errors[t], list(self.locations[t])) for t, c in ranked]
+
+def _aggregate_file(file_path: str, search_string: str, case_sensitive: bool, options: Optional[ScanOptions],
+                    summary: HeavyHitters, times: int=1) -> Tuple[int, Optional[Exception]]:
+    """
+    Feed the normalized hits of one file into 'summary'; returns (matching lines, error).
+    """
+    lines = 0
+    try:
+        for line_no, _, offset, snippet, _, _ in iter_file_hits(file_path, search_string, case_sensitive, options):
+            summary.add(normalize_line(snippet), (file_path, line_no, offset), times)
+            lines += 1
+    except Exception as e:
+        return lines, e
+    return lines, None
+
+def aggregate_files(files: List[str], search_string: str, summary: HeavyHitters, case_sensitive: bool=False,
+                    workers: int=DEFAULT_WORKERS, options: Optional[ScanOptions]=None,
+                    duplicates: Optional[Dict[str, List[str]]]=None) -> Generator[Tuple[str, int, Optional[Exception]], None, None]:
+    """
+    Count the matching lines of 'files' by template (see normalize_line) in 'summary'
+    instead of collecting them, and yield (file_path, matching lines, error) per file in
+    completion order. Files are read with per-device concurrency like scan_files; copies
+    listed in 'duplicates' are counted without being read.
+    """
+    copies = {p for same in duplicates.values() for p in same} if duplicates else set()
+
+    def job(file_path: str) -> tuple:
+        times = 1 + len(duplicates.get(file_path, ())) if duplicates else 1
+        return (file_path,) + _aggregate_file(file_path, search_string, case_sensitive, options, summary, times)
+
+    scanned = [p for p in files if p not in copies]
+    if workers <= 1 or len(scanned) <= 1:
+        results = (job(p) for p in scanned)
+    else:
+        results = _run_per_device(scanned, lambda p: (job(p),), workers)
+    try:
+        for result in results:
+            yield result
+            for p in duplicates.get(result[0], ()) if duplicates else ():
+                yield (p,) + result[1:]
+    finally:
+        results.close()
+
+# ------------------ Search and replace ------------------
+
+class _EncodingSwitched(Exception):
+    """
+    Raised by replace_in_file when output already written under utf-8 would differ in gbk.
+    """
+
+def replace_in_file(file_path: str, search_string: str, replacement: str, case_sensitive: bool=False,
+                    block_size: int=DEFAULT_BLOCK_SIZE, encoding: Optional[str]=None) -> int:
+    """
+    Replace every occurrence of 'search_string' in file_path with 'replacement' in a single
+    streaming pass and return the number of replacements.
+
+    The file is decoded like iter_hits (utf-8, else gbk) and written back in the same
+    encoding, so everything outside the replacements keeps its original bytes.
+    Files without a match are never written. Otherwise a temp file is created next to
+    the original on the first match (the unchanged prefix is copied over as raw bytes)
+    and renamed over the original at the end, so readers never see a partial file.
+    A symlink is followed: the file it points to is rewritten and the link stays. The new
+    file gets the original's permissions and, where the process may set it, its owner.
+    """
+    if not search_string:
+        raise ValueError("search string must not be empty")
+    # renaming over a symlink would replace the link and leave its target unchanged
+    target = os.path.realpath(file_path)
+    rx = re.compile(re.escape(search_string), 0 if case_sensitive else re.IGNORECASE)
+    hold = len(search_string) - 1
+    out = None
+    tmp_path = None
+    count = 0
+    done = 0  # bytes of the original before the first match, while nothing is written yet
+
+    def _emit(data: str, final: bool, enc: str, errors: str) -> str:
+        nonlocal out, tmp_path, count, done
+        limit = len(data) if final else max(0, len(data) - hold)
+        parts = []
+        pos = 0
+        for m in rx.finditer(data):
+            if m.start() >= limit:
+                break
+            parts.append(data[pos:m.start()])
+            parts.append(replacement)
+            pos = m.end()
+        cut = max(pos, limit)
+        parts.append(data[pos:cut])
+        if out is None:
+            if len(parts) == 1:
+                done += _byte_len(parts[0], enc, errors)
+                return data[cut:]
+            fd, tmp_path = tempfile.mkstemp(prefix="." + os.path.basename(target) + ".",
+                                            suffix=".tmp", dir=os.path.dirname(target))
+            out = os.fdopen(fd, "wb")
+            # copy the unchanged prefix from the file being read, then continue where it was
+            resume = src.tell()
+            src.seek(0)
+            while done:
+                block = src.read(min(block_size, done))
+                if not block:
+                    break
+                out.write(block)
+                done -= len(block)
+            src.seek(resume)
+        count += (len(parts) - 1) // 2
+        out.write("".join(parts).encode(enc, errors))
+        return data[cut:]
+
+    switched = None
+    try:
+        with _open_binary(target) as src:
+            carry, carry_enc = "", None
+            for text, enc, errors in _iter_text_blocks(src, block_size, encoding):
+                if carry_enc is not None and carry_enc != (enc, errors):
+                    # utf-8 turned out to be wrong: text kept or replaced so far must be re-encoded
+                    if not carry.isascii() or (out is not None and not replacement.isascii()):
+                        raise _EncodingSwitched(enc)
+                carry = _emit(carry + text, False, enc, errors)
+                carry_enc = (enc, errors)
+            if carry_enc is not None:
+                _emit(carry, True, *carry_enc)
+        if out is not None:
+            out.close()
+            _copy_owner_and_mode(target, tmp_path)
+            os.replace(tmp_path, target)
+            tmp_path = None
+    except _EncodingSwitched as e:
+        switched = e.args[0]
+    finally:
+        if tmp_path is not None:
+            out.close()
+            os.remove(tmp_path)
+    if switched is not None:
+        # start over, decoding and writing the whole file in the encoding found
+        return replace_in_file(file_path, search_string, replacement, case_sensitive, block_size, switched)
+    return count
+
+def _copy_owner_and_mode(src: str, dst: str):
+    shutil.copymode(src, dst)
+    if hasattr(os, "chown"):
+        st = os.stat(src)
+        try:
+            os.chown(dst, st.st_uid, st.st_gid)
+        except PermissionError:
+            # only root may give a file away; a group it cannot set keeps the default
+            with contextlib.suppress(PermissionError):
+                os.chown(dst, -1, st.st_gid)
+
+def replace_files(files: List[str], search_string: str, replacement: str, case_sensitive: bool=False,
+                  workers: int=DEFAULT_WORKERS,
+                  block_size: int=DEFAULT_BLOCK_SIZE) -> Generator[Tuple[str, int, Optional[Exception]], None, None]:
+    """
+    Run replace_in_file over 'files' with per-device concurrency (like scan_files)
+    and yield (file_path, replacements, error) in completion order.
+    """
+    def _job(file_path):
+        try:
+            return file_path, replace_in_file(file_path, search_string, replacement, case_sensitive, block_size), None
+        except Exception as e:
+            return file_path, 0, e
+
+    if workers <= 1 or len(files) <= 1:
+        for file_path in files:
+            yield _job(file_path)
+        return
+    yield from _run_per_device(files, lambda p: (_job(p),), workers)
+
+# ------------------ Python API ------------------
+
+class Match:
+    """
+    One match, as yielded by search().
+
+    path:    file containing the match
+    line:    1-based line number (first line of the record for CSV); 0 when unknown
+             because a time window skipped the start of the file
+    column:  1-based character column of the match within the line
+    offset:  byte offset of the match in the file
+    snippet: the whole line, or a window around the match when 'clipped'
+    field:   '/row/column' or JSON pointer for structured hits, '' for plain text
+    """
+    __slots__ = ("path", "line", "column", "offset", "snippet", "clipped", "field")
+
+    def __init__(self, path: str, line: int, column: int, offset: int, snippet: str,
+                 clipped: bool=False, field: str=""):
+        self.path = path
+        self.line = line
+        self.column = column
+        self.offset = offset
+        self.snippet = snippet
+        self.clipped = clipped
+        self.field = field
+
+    def __repr__(self) -> str:
+        return (f"Match(path={self.path!r}, line={self.line}, column={self.column}, "
+                f"offset={self.offset}, snippet={self.snippet!r})")
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, Match):
+            return NotImplemented
+        return all(getattr(self, k) == getattr(other, k) for k in self.__slots__)
+
+    def __hash__(self) -> int:
+        return hash(tuple(getattr(self, k) for k in self.__slots__))
+
+def search(query: str,
+           roots: Union[str, List[str]]="",
+           file_patterns: Union[str, List[str]]="*.txt",
+           case_sensitive: bool=False,
+           recursive: bool=False,
+           workers: int=DEFAULT_WORKERS,
+           file_filter: Optional[FileFilter]=None,
+           ordered: bool=True,
+           options: Optional[ScanOptions]=None,
+           on_error: Optional[Callable[[str, Exception], None]]=None,
+           follow_links: bool=False,
+           dedupe_content: bool=False,
+           order: Optional[str]=None,
+           max_hits: Optional[int]=None) -> Generator[Match, None, None]:
+    """
+    Search the files under 'roots' and yield a Match per matching line, using the same
+    scanner and per-device scheduling as the command line and the GUI.
+
+    Matches are yielded while files are being scanned and those of one file are yielded
+    together; files come in discovery order unless 'ordered' is False. Files that cannot be read are passed to on_error(path, error)
+    after their matches (skipped when on_error is None). With dedupe_content, byte-identical
+    files are scanned once and their matches repeated for every copy. 'order' decides
+    which files are scanned first (see iter_files) and 'max_hits' ends the search after
+    that many matches. Stopping the iteration early cancels the reads still in progress:
+
+        for m in search("timeout", ["/var/log"], "*.log", recursive=True):
+            print(m.path, m.line, m.snippet)
+            break
+    """
+    files = iter_files(roots, file_patterns, recursive=recursive, file_filter=file_filter, follow_links=follow_links,
+                       order=order)
+    duplicates = find_duplicates(files) if dedupe_content else None
+    options = copy.copy(options) if options is not None else ScanOptions()
+    cancel = options.cancel = threading.Event()
+    if max_hits is not None:
+        # a per-file cap the caller set in 'options' stays when no overall limit is given
+        options.max_hits = max_hits
+    remaining = max_hits
+    results = scan_files(files, query, case_sensitive, workers=workers, ordered=ordered, options=options,
+                         duplicates=duplicates)
+    try:
+        for file_path, hits, last, error in results:
+            if remaining is not None:
+                hits = hits[:remaining]
+                remaining -= len(hits)
+            for line, column, offset, snippet, clipped, field in hits:
+                yield Match(file_path, line, column, offset, snippet, clipped, field)
+            if last and error is not None and on_error is not None:
+                on_error(file_path, error)
+            if remaining == 0:
+                return
+    finally:
+        cancel.set()
+        results.close()
 
 def search_in_files(search_string: str,
                     file_extension: Union[str, List[str]]="*.txt",
                     case_sensitive: bool=False,
-                    directory: str="",
-                    recursive: bool=False) -> int:
+                    directory: Union[str, List[str]]="",
+                    recursive: bool=False,
+                    workers: int=DEFAULT_WORKERS,
+                    file_filter: Optional[FileFilter]=None,
+                    ordered: bool=True,
+                    options: Optional[ScanOptions]=None,
+                    follow_links: bool=False,
+                    dedupe_content: bool=False,
+                    order: Optional[str]=None,
+                    max_hits: Optional[int]=None,
+                    store=None,
+                    aggregate: Optional[int]=None,
+                    checkpoint: Optional[str]=None) -> int:
     """
     Search for 'search_string' under 'directory' (blank -> current dir).
+    'directory' may be a list of roots; their files are scanned with per-device
+    concurrency and the results are merged into one output stream, in discovery
+    order unless 'ordered' is False (then in completion order).
+    'file_filter' restricts the candidates by mtime/size before any file is opened.
+    'options' (ScanOptions) restricts CSV/JSON files to selected columns/key paths.
+    'follow_links' enters symlinked subdirectories; 'dedupe_content' scans byte-identical
+    files once and reports the matches under every copy.
+    'order' decides which files are scanned first (see iter_files); with 'max_hits'
+    the search stops as soon as that many matches have been printed.
+    With 'store' (result_store.ResultStore) the matches are also recorded there,
+    so the search can be listed and shown again later without rescanning.
+    With 'aggregate' the matching lines are not printed; instead they are counted by
+    template (see normalize_line, HeavyHitters) and the 'aggregate' most frequent
+    templates are reported with their counts and example locations.
+    With 'checkpoint' (a file path) the progress is saved there periodically and when
+    the search is interrupted; running the same search again reports the saved results,
+    skips the finished files and continues plain-text files from the last saved line.
+    The checkpoint is removed once the search completes.
     Returns the number of files that contain at least one match.
     """
-    directory = _normalize_dir(directory)
-    files = iter_files(directory, file_extension, recursive=recursive)
+    if checkpoint is not None and (max_hits is not None or aggregate):
+        raise ValueError("checkpoint cannot be combined with max_hits or aggregate")
+    files = iter_files(directory, file_extension, recursive=recursive, file_filter=file_filter, follow_links=follow_links,
+                       order=order)
+    # absolute roots for --store and checkpoints, before 'directory' becomes the display string
+    roots = _normalize_dirs(directory)
+    directory = _describe_dirs(directory)
 
     if not files:
-        print(f"在目录 '{directory}' 中未找到匹配 {file_extension} 的文件")
+        print(f"在目录 '{directory}' 中未找到匹配 {_describe_patterns(file_extension)} 的文件")
         return 0
 
     print(f"在目录 '{directory}' 中搜索 {len(files)} 个文件，关键字：'{search_string}'\n")
 
+    state = None
+    if checkpoint is not None:
+        state = Checkpoint(checkpoint, _describe_search(search_string, case_sensitive, roots, file_extension, recursive,
+                                                        follow_links, dedupe_content, options))
+        if state.status == "resumed":
+            print(f"从检查点 '{checkpoint}' 继续：{len(state.done)} 个文件已完成，"
+                  f"{len(state.partial)} 个文件已部分扫描\n")
+        elif state.status == "mismatch":
+            print(f"⚠️ 检查点 '{checkpoint}' 属于另一次搜索，将被覆盖\n")
+        options = copy.copy(options) if options is not None else ScanOptions()
+        options.checkpoint = state
+        window = options.time_window
+        if window is not None:
+            if state.status == "resumed" and state.window is not None:
+                # the interrupted run's window: '--since 1d' must not move while resuming
+                options.time_window = TimeWindow(*state.window, [fmt for fmt, _ in window.formats])
+            else:
+                state.window = [window.since, window.until]
+    pending = [p for p in files if p not in state.done] if state is not None else files
+
+    duplicates = find_duplicates(pending) if dedupe_content else None
+    if aggregate:
+        return _print_aggregate(files, search_string, case_sensitive, workers, options, duplicates, aggregate)
+    cancel = None
+    if max_hits is not None:
+        options = copy.copy(options) if options is not None else ScanOptions()
+        options.max_hits = max_hits
+        # set once enough matches are in, so readers drop the files they are still scanning
+        cancel = options.cancel = threading.Event()
+    recorder = None
+    if store is not None:
+        recorder = store.begin_search(search_string, {
+            "dirs": roots, "patterns": _describe_patterns(file_extension),
+            "recursive": recursive, "case_sensitive": case_sensitive,
+            "structured": bool(options is not None and (options.csv_columns or options.json_paths))})
+    remaining = max_hits
     found_files = 0
-    for file_path in files:
-        try:
-            first = True
-            for line_num, line in iter_matches(file_path, search_string, case_sensitive):
-                if first:
+    if state is not None:
+        # results saved by the interrupted run come first
+        for file_path, matches in state.iter_done():
+            if matches:
+                _print_file_hits(file_path, matches)
+                found_files += 1
+                if recorder is not None:
+                    recorder.add(file_path, matches)
+        state.start_autosave()
+    results = scan_files(pending, search_string, case_sensitive, workers=workers, ordered=ordered,
+                         options=options, duplicates=duplicates)
+    # hits of the file being printed: whether its header is out, and all of them for the checkpoint
+    started, file_hits = False, []
+    try:
+        for file_path, matches, last, error in results:
+            if remaining is not None:
+                matches = matches[:remaining]
+                remaining -= len(matches)
+            if matches:
+                if not started:
                     print(f"🔍 命中：{file_path}")
-                    first = False
                     found_files += 1
-                print(f"   行 {line_num}: {line.strip()}")
-            if not first:
+                    started = True
+                for hit in matches:
+                    print(_format_hit(hit, "   "))
+                if recorder is not None:
+                    recorder.add(file_path, matches)
+                if state is not None:
+                    file_hits.extend(matches)
+            if started and (last or remaining == 0):
                 print("-" * 50)
-        except Exception as e:
-            print(f"❌ 处理文件失败 '{file_path}': {e}")
+                started = False
+            if last:
+                if error is not None:
+                    print(f"❌ 处理文件失败 '{file_path}': {error}")
+                if state is not None:
+                    state.complete(file_path, file_hits)
+                    file_hits = []
+            if remaining == 0:
+                cancel.set()
+                results.close()
+                print(f"\n已在前 {max_hits} 个匹配后停止")
+                break
+    except BaseException:
+        if cancel is not None:
+            cancel.set()
+        # Ctrl-C or a failure: keep what has been found so far; the stored search stays unfinished
+        if recorder is not None:
+            recorder.flush()
+        if state is not None:
+            state.close(finished=False)
+            print(f"\n进度已保存到检查点 '{checkpoint}'")
+        raise
+    if state is not None:
+        state.close(finished=True)
 
     print(f"\n搜索完成！在 {found_files} 个文件中发现 '{search_string}'")
+    if recorder is not None:
+        recorder.finish()
+        print(f"结果已保存为搜索 #{recorder.search_id}")
     return found_files
 
+class _PipeReader:
+    """
+    Binary reader over a pipe that returns whatever is available instead of
+    waiting for a full block, and calls 'before_wait' (e.g. flushing the output)
+    before every read that may block.
+    """
+    def __init__(self, raw, before_wait: Callable[[], None]):
+        self.raw = raw
+        self.before_wait = before_wait
+        self.read1 = raw.read1 if hasattr(raw, "read1") else raw.read
+
+    def read(self, size: int=-1) -> bytes:
+        self.before_wait()
+        return self.read1(size)
+
+def search_stream(search_string: str, case_sensitive: bool=False, stream=None,
+                  options: Optional[ScanOptions]=None, max_hits: Optional[int]=None,
+                  store=None, label: str="(stdin)") -> int:
+    """
+    Search a binary stream (default: standard input) as it arrives, e.g. the output
+    of journalctl or kubectl logs, and print one line per hit.
+    Lines are decoded incrementally with the same utf-8/gbk detection as files.
+    Output is flushed whenever the input has nothing more to read yet, so hits
+    appear immediately in live use while a fast producer still gets buffered output.
+    Multi-line and regex matches (options.multiline/regex) are reported once the
+    text after them has arrived or the stream ends. Hits go to stdout and the summary
+    to stderr, so the output can be piped on. Returns the number of hits.
+    """
+    options = options or ScanOptions()
+    if options.time_window is not None or options.csv_columns or options.json_paths:
+        raise ValueError("time windows and CSV/JSON selectors need files")
+    if stream is None:
+        stream = sys.stdin.buffer
+    raw = _PipeReader(stream, sys.stdout.flush)
+    if options.multiline or options.regex:
+        pattern = compile_pattern(search_string, case_sensitive, options.regex)
+        hits = iter_multiline_hits(raw, pattern, options.block_size)
+    else:
+        hits = iter_hits(raw, search_string, case_sensitive, options.block_size, live=True)
+    recorder = None
+    if store is not None:
+        recorder = store.begin_search(search_string, {
+            "dirs": [label], "patterns": "", "recursive": False, "case_sensitive": case_sensitive,
+            "structured": False})
+    count = 0
+    ended = False
+    try:
+        for hit in hits:
+            print(_format_hit(hit))
+            count += 1
+            if recorder is not None:
+                recorder.add(label, [hit])
+            if count == max_hits:
+                break
+        ended = True
+    except (KeyboardInterrupt, BrokenPipeError):
+        # Ctrl-C and a closed reader are the usual ways a live stream ends
+        ended = True
+        raise
+    finally:
+        if recorder is not None:
+            if ended:
+                recorder.finish()
+            else:
+                recorder.flush()
+    sys.stdout.flush()
+    print(f"搜索完成！在 {label} 中找到 {count} 处 '{search_string}'", file=sys.stderr)
+    if recorder is not None:
+        print(f"结果已保存为搜索 #{recorder.search_id}", file=sys.stderr)
+    return count
+
+def _describe_search(search_string: str, case_sensitive: bool, roots: List[str], file_extension: Union[str, List[str]],
+                     recursive: bool, follow_links: bool, dedupe_content: bool, options: Optional[ScanOptions]) -> Dict:
+    """
+    Everything that decides which hits a search_in_files run reports, to tell whether a checkpoint belongs to it.
+    """
+    options = options or ScanOptions()
+    window = options.time_window
+    return {
+        "term": search_string, "case_sensitive": case_sensitive, "dirs": roots,
+        "patterns": [file_extension] if isinstance(file_extension, str) else list(file_extension),
+        "recursive": recursive, "follow_links": follow_links, "dedupe_content": dedupe_content,
+        "csv_columns": options.csv_columns, "csv_header": options.csv_header, "json_paths": options.json_paths,
+        "multiline": options.multiline, "regex": options.regex,
+        "time_window": window.spec + [list(window.formats)] if window is not None else None,
+    }
+
+def _format_hit(hit: Hit, indent: str="") -> str:
+    line_num, column, offset, line, clipped, field = hit
+    # continuation lines of multi-line matches are indented under the first one
+    line = line.strip().replace("\n", "\n" + indent + "   ")
+    if field and not line_num:
+        return f"{indent}偏移 {offset} [{field}]：{line}"
+    if field:
+        return f"{indent}行 {line_num} [{field}]: {line}"
+    if not line_num:
+        return f"{indent}偏移 {offset}：{line}"
+    if clipped:
+        return f"{indent}行 {line_num}，列 {column}: {line}"
+    return f"{indent}行 {line_num}: {line}"
+
+def _print_file_hits(file_path: str, matches: List[Hit]):
+    print(f"🔍 命中：{file_path}")
+    for hit in matches:
+        print(_format_hit(hit, "   "))
+    print("-" * 50)
+
+def format_location(location: Location) -> str:
+    file_path, line_no, offset = location
+    return f"{file_path}:{line_no}" if line_no else f"{file_path}@{offset}"
+
+def _print_aggregate(files: List[str], search_string: str, case_sensitive: bool, workers: int,
+                     options: Optional[ScanOptions], duplicates: Optional[Dict[str, List[str]]], top: int) -> int:
+    summary = HeavyHitters(max(top, DEFAULT_AGGREGATE_TOP) * _AGGREGATE_SLOTS)
+    found_files = 0
+    for file_path, lines, error in aggregate_files(files, search_string, summary, case_sensitive, workers=workers,
+                                                   options=options, duplicates=duplicates):
+        if lines:
+            found_files += 1
+        if error is not None:
+            print(f"❌ 处理文件失败 '{file_path}': {error}")
+
+    ranked = summary.top(top)
+    print(f"{found_files} 个文件中共 {summary.total} 行匹配，出现最多的 {len(ranked)} 种行模式：\n")
+    for template, count, error, locations in ranked:
+        print(f"{count:>9}  {template}")
+        if error:
+            print(f"{'':>9}  （计数最多可能偏高 {error}）")
+        print(f"{'':>9}  例如 {', '.join(format_location(loc) for loc in locations)}")
+    print(f"\n搜索完成！在 {found_files} 个文件中发现 '{search_string}'")
+    return found_files
+
+def print_history(store, limit: int=20):
+    """
+    List the most recent searches recorded in 'store' (result_store.ResultStore).
+    """
+    searches = store.history(limit)
+    if not searches:
+        print("没有已保存的搜索")
+        return
+    for entry in searches:
+        started = datetime.datetime.fromtimestamp(entry["started"]).strftime("%Y-%m-%d %H:%M:%S")
+        state = "" if entry["finished"] is not None else "（已中断）"
+        dirs = ", ".join(entry["params"].get("dirs", []))
+        print(f"#{entry['id']}  {started}  '{entry['term']}'  {entry['files']} 个文件中 {entry['matches']} 处匹配  [{dirs}]{state}")
+
+def show_stored_search(store, search_id: int) -> int:
+    """
+    Print a search recorded in 'store' like search_in_files did, without rescanning.
+    Returns the number of files with matches (0 if the search is unknown).
+    """
+    entry = store.get_search(search_id)
+    if entry is None:
+        print(f"没有已保存的搜索 #{search_id}")
+        return 0
+    print(f"已保存的搜索 #{search_id}，关键词：'{entry['term']}'\n")
+    found_files = 0
+    for file_path, matches in store.iter_file_hits(search_id):
+        _print_file_hits(file_path, matches)
+        found_files += 1
+    print(f"\n在 {found_files} 个文件中找到 '{entry['term']}'")
+    return found_files
+
+def replace_in_files(search_string: str,
+                     replacement: str,
+                     file_extension: Union[str, List[str]]="*.txt",
+                     case_sensitive: bool=False,
+                     directory: Union[str, List[str]]="",
+                     recursive: bool=False,
+                     workers: int=DEFAULT_WORKERS,
+                     file_filter: Optional[FileFilter]=None,
+                     follow_links: bool=False) -> int:
+    """
+    Replace 'search_string' with 'replacement' in the files under 'directory' (see replace_in_file).
+    Files are rewritten in parallel per device; files without a match are left untouched.
+    Returns the number of files changed.
+    """
+    files = iter_files(directory, file_extension, recursive=recursive, file_filter=file_filter, follow_links=follow_links)
+    directory = _describe_dirs(directory)
+
+    if not files:
+        print(f"在目录 '{directory}' 中未找到匹配 {_describe_patterns(file_extension)} 的文件")
+        return 0
+
+    print(f"正在将 '{search_string}' 替换为 '{replacement}'，目录 '{directory}' 中共 {len(files)} 个文件\n")
+
+    changed_files = 0
+    total = 0
+    for file_path, count, error in replace_files(files, search_string, replacement, case_sensitive, workers=workers):
+        if count:
+            print(f"✏️ {file_path}：替换 {count} 处")
+            changed_files += 1
+            total += count
+        if error is not None:
+            print(f"❌ 处理文件失败 '{file_path}': {error}")
+
+    print(f"\n替换完成！共在 {changed_files} 个文件中替换 {total} 处")
+    return changed_files
+
 # ------------------ Interactive CLI (preserved & improved) ------------------
 
 def _prompt_directory() -> str:
@@ -1,5 +1,6 @@
 # -*- coding: utf-8 -*-
 import argparse
+import re
 import sys
 import os
 
@@ -9,6 +10,15 @@ if SCRIPT_DIR not in sys.path:
     sys.path.insert(0, SCRIPT_DIR)
 
 import file_text_searcher as core
+import result_store
+
+def _time_arg(text: str) -> str:
+    # checked here, resolved by TimeWindow, which keeps the text for --checkpoint
+    try:
+        core.parse_time(text)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e)) from None
+    return text
 
 def _parse_args():
     p = argparse.ArgumentParser(
@@ -20,22 +30,131 @@ def _parse_args():
 
     p.add_argument("-s", "--search", help="要搜索的字符串（若未提供则进入交互模式）")
     p.add_argument("-b", "--batch", nargs="+", help="批量搜索多个字符串（以空格分隔）")
-    p.add_argument("-d", "--dir", default="", help="要搜索的目录（留空=当前目录）")
+    p.add_argument("--replace", metavar="TEXT", help="将搜索词原地替换为 TEXT（无匹配的文件不会被写入）")
+    p.add_argument("-d", "--dir", nargs="+", action="extend", default=[], help="要搜索的目录（可多次指定，留空=当前目录）")
+    p.add_argument("--stdin", action="store_true", help="搜索持续到达的标准输入而不是文件（等同于 -d -）")
     p.add_argument("-e", "--ext", action="append", help="文件通配符（可多次使用，例如 -e *.txt -e *.log）")
     p.add_argument("--all-types", action="store_true", help="使用常见文本类型（*.txt, *.log, *.csv, *.xml, *.json）")
     p.add_argument("-R", "--recursive", action="store_true", help="包含子目录")
+    p.add_argument("-L", "--follow-links", action="store_true", help="跟随符号链接的子目录（每个目录只访问一次）")
+    p.add_argument("--dedupe-content", action="store_true", help="内容完全相同的文件只扫描一次，并为每个副本报告匹配")
     p.add_argument("-i", "--case-sensitive", action="store_true", help="区分大小写")
+    p.add_argument("-M", "--multiline", action="store_true", help="允许搜索词跨行（换行写作 \\n）；匹配结果报告起止行号")
+    p.add_argument("-E", "--regex", action="store_true", help="将搜索词视为可跨行的正则表达式")
+    p.add_argument("--newer-than", type=core.parse_time, metavar="AGE|DATE", help="仅搜索在此时长/日期之后修改的文件（例如 1d、12h、2024-05-01）")
+    p.add_argument("--older-than", type=core.parse_time, metavar="AGE|DATE", help="仅搜索在此时长/日期之前修改的文件")
+    p.add_argument("--min-size", type=core.parse_size, metavar="SIZE", help="仅搜索不小于此大小的文件（例如 10k、5M）")
+    p.add_argument("--max-size", type=core.parse_size, metavar="SIZE", help="仅搜索不大于此大小的文件（例如 1G）")
+    p.add_argument("--since", type=_time_arg, metavar="AGE|DATE", help="仅搜索时间戳不早于此时长/日期的日志行（文件须按时间排序）")
+    p.add_argument("--until", type=_time_arg, metavar="AGE|DATE", help="仅搜索时间戳不晚于此时长/日期的日志行")
+    p.add_argument("--time-format", action="append", metavar="FORMAT", help="每行开头时间戳的 strptime 格式（可重复，默认：类 ISO 格式）")
+    p.add_argument("--csv-column", action="append", metavar="NAME|N", help="仅在该 CSV 列中匹配（表头名或从 1 开始的列号，可重复）")
+    p.add_argument("--csv-no-header", action="store_true", help="CSV 文件没有表头：第一条记录即为数据，按列号选择列")
+    p.add_argument("--json-path", action="append", metavar="PATH", help="仅匹配该 JSON 键路径下的值（例如 items.*.name、/items/*/name、**.message；可重复）")
+    p.add_argument("-j", "--jobs", type=int, default=core.DEFAULT_WORKERS, help="每个 SSD/远程设备的并行读取数（机械硬盘始终顺序读取）")
+    p.add_argument("--max-read-rate", type=core.parse_size, metavar="RATE", help="限制总读取速率，单位字节/秒（如 20M）；使用令牌桶平滑限速")
+    p.add_argument("--max-open-files", type=int, metavar="N", help="限制同时打开的文件数")
+    p.add_argument("--read-buffer", type=core.parse_size, default=core.DEFAULT_READ_BUFFER, metavar="SIZE", help="每次从存储读取的字节数（例如 4M；默认 1M）")
+    p.add_argument("--drop-cache", action="store_true", help="扫描完成后将每个文件的页面从系统缓存中释放")
+    p.add_argument("--nice", action="store_true", help="降低搜索的 CPU 和 I/O 优先级")
+    p.add_argument("--order", choices=sorted(core.FILE_ORDERS), help="按此顺序扫描文件：最新优先、最小优先或按路径（默认：发现顺序）")
+    p.add_argument("--first", type=int, metavar="N", help="找到前 N 个匹配后停止")
+    p.add_argument("--unordered", action="store_true", help="文件一旦扫描完成立即输出，而非按发现顺序输出")
+    p.add_argument("--aggregate", nargs="?", type=int, const=core.DEFAULT_AGGREGATE_TOP, metavar="K", help="报告出现最多的 K 种匹配行模式（屏蔽数字、UUID、时间戳），而不是逐行输出（默认 K：%(const)s）")
+    p.add_argument("--store", nargs="?", const=result_store.DEFAULT_STORE_PATH, metavar="DB", help="同时将结果记录到 SQLite 结果库（默认：~/.text_searcher/results.db）")
+    p.add_argument("--history", action="store_true", help="列出结果库中记录的搜索")
+    p.add_argument("--checkpoint", metavar="FILE", help="将进度保存到 FILE，中断的搜索再次运行同一命令即可继续")
+    p.add_argument("--show", type=int, metavar="ID", help="从结果库输出已记录的搜索，无需重新扫描")
+
+    args = p.parse_args()
+    if args.csv_no_header and any(not c.isdigit() for c in args.csv_column or []):
+        p.error("--csv-no-header 只能按列号选择列（例如 --csv-column 2）")
+    if "-" in args.dir:
+        if len(args.dir) > 1:
+            p.error("-d -（标准输入）不能与其他目录同时使用")
+        args.stdin, args.dir = True, []
+    if args.stdin:
+        if not args.search:
+            p.error("--stdin 需要搜索词（-s）")
+        if args.dir or args.batch or args.replace is not None or args.aggregate is not None or args.checkpoint:
+            p.error("--stdin 只搜索一个词（-s），不能与 -d、-b/--batch、--replace、--aggregate 或 --checkpoint 同时使用")
+        if args.since is not None or args.until is not None or args.csv_column or args.json_path:
+            p.error("--since/--until 和 --csv-column/--json-path 需要文件，不能用于 --stdin")
+    if not 64 * 1024 <= args.read_buffer <= 256 * 1024 * 1024:
+        p.error("--read-buffer 必须在 64k 到 256M 之间")
+    if args.first is not None and args.first < 1:
+        p.error("--first 至少为 1")
+    if args.aggregate is not None:
+        if args.aggregate < 1:
+            p.error("--aggregate 至少为 1")
+        if args.replace is not None or args.store or args.first is not None:
+            p.error("--aggregate 不能与 --replace、--store 或 --first 同时使用")
+    if args.checkpoint and (args.batch or args.first is not None or args.aggregate is not None or args.replace is not None):
+        p.error("--checkpoint 不能与 -b/--batch、--first、--aggregate 或 --replace 同时使用")
+    if args.regex:
+        for term in [args.search] + (args.batch or []):
+            try:
+                core.compile_pattern(term or "", regex=True)
+            except re.error as e:
+                p.error(f"无效的正则表达式 '{term}'：{e}")
+    if args.replace is not None:
+        if args.multiline or args.regex:
+            p.error("--replace 仅作用于单行普通文本，不能与 --multiline/--regex 同时使用")
+        if not args.search or args.batch:
+            p.error("--replace 需要 -s/--search，且不能与 -b/--batch 同时使用")
+        if args.csv_column or args.json_path:
+            p.error("--replace 仅作用于纯文本，不能与 --csv-column/--json-path 同时使用")
+        if args.store:
+            p.error("--store 用于记录搜索，不能与 --replace 同时使用")
+    return args
+
+def _broken_pipe():
+    # the reader went away (e.g. '| head'): stop quietly like other pipeline tools;
+    # stdout now points to devnull so the flush at interpreter exit cannot fail again
+    devnull = os.open(os.devnull, os.O_WRONLY)
+    os.dup2(devnull, sys.stdout.fileno())
+    sys.exit(1)
 
-    return p.parse_args()
+def _search_stdin(args):
+    options = core.ScanOptions(multiline=args.multiline, regex=args.regex)
+    store = result_store.ResultStore(args.store) if args.store else None
+    try:
+        core.search_stream(args.search, args.case_sensitive, options=options, max_hits=args.first, store=store)
+    except BrokenPipeError:
+        _broken_pipe()
+    except KeyboardInterrupt:
+        sys.exit(130)
+    finally:
+        if store is not None:
+            store.close()
 
 def main():
     args = _parse_args()
 
+    core.set_io_limits(args.max_read_rate, args.max_open_files, args.read_buffer, args.drop_cache)
+    if args.nice and not core.lower_priority():
+        print("⚠️ 无法降低进程优先级")
+
     if args.gui:
         import gui_app
         gui_app.launch()
         return
 
+    if args.history or args.show is not None:
+        store = result_store.ResultStore(args.store or result_store.DEFAULT_STORE_PATH)
+        try:
+            if args.show is not None:
+                core.show_stored_search(store, args.show)
+            else:
+                core.print_history(store)
+        finally:
+            store.close()
+        return
+
+    if args.stdin:
+        _search_stdin(args)
+        return
+
     # If neither search nor batch provided, or --interactive forced -> menu
     if args.interactive or (not args.search and not args.batch):
         core.menu_loop()
@@ -49,14 +168,36 @@ def main():
     else:
         patterns = ["*.txt"]
 
-    if args.batch:
-        for term in args.batch:
-            print(f"\n>>> 搜索: '{term}'")
-            for pat in patterns:
-                core.search_in_files(term, pat, args.case_sensitive, args.dir, args.recursive)
-    else:
-        for pat in patterns:
-            core.search_in_files(args.search, pat, args.case_sensitive, args.dir, args.recursive)
+    file_filter = core.FileFilter(args.newer_than, args.older_than, args.min_size, args.max_size)
+    time_window = None
+    if args.since is not None or args.until is not None:
+        time_window = core.TimeWindow(args.since, args.until, args.time_format)
+    options = core.ScanOptions(csv_columns=args.csv_column, json_paths=args.json_path, time_window=time_window,
+                               csv_header=not args.csv_no_header,
+                               multiline=args.multiline, regex=args.regex)
+
+    store = result_store.ResultStore(args.store) if args.store else None
+
+    # all patterns go into one search so --order and --first apply across them
+    try:
+        if args.replace is not None:
+            core.replace_in_files(args.search, args.replace, patterns, args.case_sensitive, args.dir, args.recursive, workers=args.jobs, file_filter=file_filter, follow_links=args.follow_links)
+        elif args.batch:
+            for term in args.batch:
+                print(f"\n>>> 搜索: '{term}'")
+                core.search_in_files(term, patterns, args.case_sensitive, args.dir, args.recursive, workers=args.jobs, file_filter=file_filter, ordered=not args.unordered, options=options, follow_links=args.follow_links, dedupe_content=args.dedupe_content, order=args.order, max_hits=args.first, store=store, aggregate=args.aggregate)
+        else:
+            core.search_in_files(args.search, patterns, args.case_sensitive, args.dir, args.recursive, workers=args.jobs, file_filter=file_filter, ordered=not args.unordered, options=options, follow_links=args.follow_links, dedupe_content=args.dedupe_content, order=args.order, max_hits=args.first, store=store, aggregate=args.aggregate, checkpoint=args.checkpoint)
+    except BrokenPipeError:
+        _broken_pipe()
+    except KeyboardInterrupt:
+        if not args.checkpoint:
+            raise
+        # the checkpoint has been saved; run the same command again to resume
+        sys.exit(130)
+    finally:
+        if store is not None:
+            store.close()
 
 if __name__ == "__main__":
     main()